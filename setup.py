@@ -23,7 +23,7 @@ setup(
     license="Closed",
     keywords="JSON RESTful",
     url="http://about.retickr.com",
-    packages=['sleepy'],
+    packages=['sleepy', 'sleepy.management', 'sleepy.management.commands'],
     long_description=read('README'),
     dependency_links = [],
     install_requires=[
@@ -0,0 +1,222 @@
+"""
+Sleepy Admission Control
+
+Bounds the number of requests a worker process runs at once so that a
+slow database degrades the API gracefully instead of tying up every
+worker. Requests are admitted against a global limit and an optional
+per-handler limit. When a limit is reached a request may wait in a
+short, bounded queue, after that it is shed. Priority classes let
+reads keep running while writes and expensive endpoints are shed
+first.
+
+This module also holds the runtime read only flag, which can be
+flipped without a settings change or a deploy.
+"""
+
+# Universe imports
+import time
+import threading
+
+# Thirdparty imports
+from django.conf import settings
+from django.core.cache import cache
+
+PRIORITY_CRITICAL = 'critical'
+PRIORITY_READ = 'read'
+PRIORITY_WRITE = 'write'
+PRIORITY_EXPENSIVE = 'expensive'
+
+# The fraction of a limiter's capacity (and queue) each priority class
+# may use. Lower shares are shed first as a limiter fills up.
+ADMISSION_PRIORITY_SHARES = getattr(
+    settings,
+    'SLEEPY_ADMISSION_PRIORITY_SHARES',
+    {
+        PRIORITY_CRITICAL: 1.0,
+        PRIORITY_READ: 1.0,
+        PRIORITY_WRITE: 0.75,
+        PRIORITY_EXPENSIVE: 0.5,
+    }
+)
+
+# The maximum number of requests a worker process runs at once across
+# all handlers, None disables the global limit
+ADMISSION_MAX_IN_FLIGHT = getattr(settings, 'SLEEPY_MAX_IN_FLIGHT', None)
+
+ADMISSION_MAX_QUEUED = getattr(settings, 'SLEEPY_MAX_QUEUED', 0)
+
+# Seconds a queued request waits for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT = getattr(settings, 'SLEEPY_QUEUE_TIMEOUT', 0.05)
+
+# The Retry-After value (in seconds) sent with shed requests
+ADMISSION_RETRY_AFTER = getattr(settings, 'SLEEPY_RETRY_AFTER', 1)
+
+READ_ONLY_CACHE_KEY = getattr(
+    settings,
+    'SLEEPY_READ_ONLY_CACHE_KEY',
+    'sleepy:read_only'
+)
+
+# How often (in seconds) a worker re-reads the runtime read only flag
+READ_ONLY_REFRESH = getattr(settings, 'SLEEPY_READ_ONLY_REFRESH', 5)
+
+READ_ONLY_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class ConcurrencyLimiter(object):
+    """
+    Counts the requests in flight against a limit. A request that
+    finds the limiter full may wait up to queue_timeout seconds for a
+    slot as long as fewer than max_queued requests are already
+    waiting. Each priority class is only admitted while the limiter is
+    below its share of the limit.
+    """
+
+    def __init__(self, limit, max_queued=0, queue_timeout=0.0):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    def _share(self, value, priority):
+        return int(value * ADMISSION_PRIORITY_SHARES.get(priority, 1.0))
+
+    def acquire(self, priority=PRIORITY_READ, timeout=None):
+        """
+        Takes a slot in the limiter, returns False if the request should
+        be shed instead
+        """
+        capacity = max(1, self._share(self.limit, priority))
+
+        if timeout is None:
+            timeout = self.queue_timeout
+
+        with self._condition:
+            if self.in_flight < capacity:
+                self.in_flight += 1
+                return True
+
+            if (timeout <= 0
+                    or self.queued >= self._share(self.max_queued, priority)):
+                return False
+
+            self.queued += 1
+            try:
+                give_up_at = time.time() + timeout
+                while self.in_flight >= capacity:
+                    remaining = give_up_at - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+
+                self.in_flight += 1
+                return True
+            finally:
+                self.queued -= 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            # Waiters have different capacities depending on their
+            # priority so every one of them needs to re-check
+            self._condition.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(key, limit, max_queued=0, queue_timeout=0.0):
+    """
+    Returns the ConcurrencyLimiter registered for key, creating it the
+    first time it's requested. Handlers share a limiter per class.
+    """
+    try:
+        return _limiters[key]
+    except KeyError:
+        with _limiters_lock:
+            if key not in _limiters:
+                _limiters[key] = ConcurrencyLimiter(
+                    limit,
+                    max_queued,
+                    queue_timeout
+                )
+            return _limiters[key]
+
+
+def global_limiter():
+    if ADMISSION_MAX_IN_FLIGHT is None:
+        return None
+
+    return limiter_for(
+        None,
+        ADMISSION_MAX_IN_FLIGHT,
+        ADMISSION_MAX_QUEUED,
+        ADMISSION_QUEUE_TIMEOUT
+    )
+
+
+def admit(limiters, priority):
+    """
+    Acquires a slot in each of the given limiters. Returns the list of
+    acquired limiters, which must be passed to release once the request
+    finishes, or None if the request should be shed.
+    """
+    acquired = []
+    for limiter in limiters:
+        if not limiter.acquire(priority):
+            release(acquired)
+            return None
+        acquired.append(limiter)
+    return acquired
+
+
+def release(limiters):
+    for limiter in reversed(limiters):
+        limiter.release()
+
+
+class Held(object):
+    """
+    Releases admitted limiters once closed. Streaming responses keep
+    working after the handler returns, Base hands them one to close
+    when the server is done sending them.
+    """
+
+    def __init__(self, limiters):
+        self.limiters = limiters
+
+    def close(self):
+        limiters, self.limiters = self.limiters, None
+        if limiters is not None:
+            release(limiters)
+
+
+_read_only = {'value': False, 'checked_at': 0}
+
+
+def is_read_only():
+    """
+    Returns the runtime read only flag. The flag lives in the cache so
+    that it's shared by every worker, but each worker only reads it
+    every READ_ONLY_REFRESH seconds.
+    """
+    now = time.time()
+    if now - _read_only['checked_at'] >= READ_ONLY_REFRESH:
+        _read_only['checked_at'] = now
+        _read_only['value'] = bool(cache.get(READ_ONLY_CACHE_KEY, False))
+
+    return _read_only['value']
+
+
+def set_read_only(read_only):
+    """
+    Turns the runtime read only flag on or off for every worker sharing
+    the cache. Other workers pick the change up within
+    READ_ONLY_REFRESH seconds.
+    """
+    cache.set(READ_ONLY_CACHE_KEY, bool(read_only), READ_ONLY_TIMEOUT)
+    _read_only['value'] = bool(read_only)
+    _read_only['checked_at'] = time.time()
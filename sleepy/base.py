@@ -14,12 +14,20 @@ __author__ = "Adam Haney"
 __license__ = "Copyright (c) 2013 Akimbo"
 
 HTTP_READ_ONLY_METHODS = ['GET', 'HEAD', 'OPTIONS']
-HTTP_METHODS = HTTP_READ_ONLY_METHODS + ['POST', 'PUT', 'DELETE']
+HTTP_METHODS = HTTP_READ_ONLY_METHODS + ['POST', 'PUT', 'PATCH', 'DELETE']
 
 import json
+import functools
 import django.http
 from django.conf import settings
 from responses import api_error
+import admission
+import bulk
+import context
+import deadlines
+import patching
+import profiling
+import watchdog
 
 CORS_SHARING_ALLOWED_ORIGINS = getattr(
     settings,
@@ -30,7 +38,7 @@ CORS_SHARING_ALLOWED_ORIGINS = getattr(
 CORS_SHARING_ALLOWED_METHODS = getattr(
     settings,
     'CORS_SHARING_ALLOWED_METHODS',
-    ['GET', 'POST', 'PUT', 'DELETE']
+    ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
 )
 
 CORS_SHARING_ALLOWED_HEADERS = getattr(
@@ -50,6 +58,27 @@ class Base:
     responses in json format.
     """
 
+    # Admission control (see sleepy.admission). max_in_flight limits how
+    # many requests a worker runs at once for this handler class,
+    # further requests wait in a queue of up to max_queued requests for
+    # queue_timeout seconds and are then shed with a 503.
+    max_in_flight = None
+    max_queued = 0
+    queue_timeout = admission.ADMISSION_QUEUE_TIMEOUT
+
+    # Maps HTTP methods to admission priority classes. Methods that
+    # aren't listed are admitted as reads or writes.
+    priority_classes = {}
+
+    # Methods that accept a JSON array of items (see sleepy.bulk) and
+    # the most items one request may hold
+    bulk_methods = ()
+    bulk_max_items = bulk.BULK_MAX_ITEMS
+
+    # Seconds a request may take (see sleepy.deadlines), clients can ask
+    # for less with the X-Request-Timeout header
+    timeout = deadlines.REQUEST_TIMEOUT
+
     def __init__(self):
         try:
             self.read_only = settings.SLEEPY_READ_ONLY
@@ -67,17 +96,114 @@ class Base:
 
         return False
 
+    def warm_up(self):
+        """
+        Builds the per class state that is otherwise built on the first
+        request, see sleepy.warmup
+        """
+        self._admission_limiters()
+
+    def _request_priority(self, request):
+        """
+        Returns the admission priority class for a request
+        """
+        if request.method in self.priority_classes:
+            return self.priority_classes[request.method]
+
+        if request.method in HTTP_READ_ONLY_METHODS:
+            return admission.PRIORITY_READ
+
+        return admission.PRIORITY_WRITE
+
+    def _admission_limiters(self):
+        """
+        Returns the concurrency limiters a request to this handler has
+        to be admitted by
+        """
+        limiters = []
+
+        global_limiter = admission.global_limiter()
+        if global_limiter is not None:
+            limiters.append(global_limiter)
+
+        if self.max_in_flight is not None:
+            limiters.append(
+                admission.limiter_for(
+                    self.__class__,
+                    self.max_in_flight,
+                    self.max_queued,
+                    self.queue_timeout
+                )
+            )
+
+        return limiters
+
+    def _dispatch(self, request, *args, **kwargs):
+        """
+        Routes the request to the method named after its HTTP method
+        """
+        if hasattr(self, request.method):
+            response = getattr(self, request.method)(request, *args, **kwargs)
+
+            # Explicitly type check here because type errors further
+            # down are harder to diagnose
+            if type(response) is None:
+                raise TypeError(
+                    "{0} returned None, should have returned a response object".format(
+                        request.method
+                    )
+                )
+
+        # Use introspection to handle HEAD requests
+        elif request.method == 'HEAD' and hasattr(self, 'GET'):
+            response = self.GET(request, *args, **kwargs)
+            if getattr(response, 'streaming', False):
+                response.streaming_content = []
+            else:
+                response.content = ""
+
+        else:
+            response = api_error(
+                "Resource does not support {0} for this method".format(
+                    request.method
+                )
+            )
+            response.status_code = 405
+
+        return response
+
     def __call__(self, request, *args, **kwargs):
+        previous_request = context.set_current_request(request)
+
+        watch = None
+        if watchdog.WATCHDOG_ENABLED:
+            watch = watchdog.start(self, request)
+
+        try:
+            return self._respond(request, *args, **kwargs)
+        finally:
+            if watch is not None:
+                watchdog.finish(watch)
+            context.set_current_request(previous_request)
+
+    def _respond(self, request, *args, **kwargs):
         # Add the request user to the class, this allows certain django decorators to work
         if hasattr(request, 'user'):
             self.user = request.user
 
-        # Check if we're in read only mode
-        if (self.read_only is True
-                and request.method not in HTTP_READ_ONLY_METHODS):
+        deadlines.start(request, self.timeout)
+
+        # Check if we're in read only mode, either through settings or
+        # the runtime flag in sleepy.admission
+        if (request.method not in HTTP_READ_ONLY_METHODS
+                and (self.read_only is True or admission.is_read_only())):
             return api_error("the API is in read only mode for maintenance")
 
-        if request.method == "PUT":
+        items = None
+        if request.method in self.bulk_methods:
+            items = bulk.bulk_items(request)
+
+        if request.method == "PUT" and items is None:
             query_dict = django.http.QueryDict(request.body)
             request.PUT = {
                 k: v
@@ -85,8 +211,18 @@ class Base:
                 in query_dict.items()}
             kwargs.update(request.PUT)
 
+        # PATCH bodies are parsed into the keypaths they change, see
+        # sleepy.patching. They're left out of kwargs, keypaths and
+        # REMOVED aren't parameters
+        if request.method == "PATCH" and items is None:
+            try:
+                request.PATCH = patching.parse_patch(request)
+            except patching.PatchError as e:
+                return api_error(str(e), "Patch Error", e.status_code)
+
         # Addd requests to kwargs
         kwargs.update(request.REQUEST)
+        kwargs.pop(profiling.PROFILE_PARAM, None)
 
         # Build our response object
         response = django.http.HttpResponse()
@@ -131,30 +267,75 @@ class Base:
 
             return response
 
-        if hasattr(self, request.method):
-            response = getattr(self, request.method)(request, *args, **kwargs)
+        watchdog.mark('admission')
+        admitted = admission.admit(
+            self._admission_limiters(),
+            self._request_priority(request)
+        )
 
-            # Explicitly type check here because type errors further
-            # down are harder to diagnose
-            if type(response) is None:
-                raise TypeError(
-                    "{0} returned None, should have returned a response object".format(
-                        request.method
-                    )
-                )
+        if admitted is None:
+            # Shed the request, the client should back off and retry
+            response = api_error(
+                "the API is overloaded, please retry shortly",
+                "Overloaded Error",
+                503,
+                headers={'Retry-After': admission.ADMISSION_RETRY_AFTER}
+            )
 
-        # Use introspection to handle HEAD requests
-        elif request.method == 'HEAD' and hasattr(self, 'GET'):
-            response = self.GET(request, *args, **kwargs)
-            response.content = ""
+        elif deadlines.expired(request):
+            admission.release(admitted)
 
-        else:
+            # The budget was spent waiting for admission
             response = api_error(
-                "Resource does not support {0} for this method".format(
-                    request.method
-                )
+                "the request timed out before it could be served",
+                "Timeout Error",
+                503,
+                headers={'Retry-After': admission.ADMISSION_RETRY_AFTER}
             )
-            response.status_code = 405
+
+        else:
+            watchdog.mark('handler')
+
+            dispatch = self._dispatch
+            if items is not None:
+                dispatch = functools.partial(bulk.dispatch, self, items)
+
+            held = False
+            try:
+                if (profiling.PROFILING_ENABLED
+                        and profiling.should_profile(request)):
+                    response = profiling.profile_call(
+                        "{0}.{1}".format(
+                            self.__class__.__name__,
+                            request.method
+                        ),
+                        dispatch,
+                        request,
+                        *args,
+                        **kwargs
+                    )
+                else:
+                    response = dispatch(request, *args, **kwargs)
+
+                # Streamed content is produced while the server sends
+                # it, the request keeps its slot until the server closes
+                # the response
+                if getattr(response, 'streaming', False):
+                    response._closable_objects.append(
+                        admission.Held(admitted)
+                    )
+                    held = True
+            except deadlines.DeadlineExceeded:
+                response = api_error(
+                    "the request ran out of time",
+                    "Timeout Error",
+                    504
+                )
+            finally:
+                if not held:
+                    admission.release(admitted)
+
+        watchdog.mark('finalize')
 
         # if supress_error_codes is set make all response codes 200
         if "suppress_response_codes" in request.REQUEST:
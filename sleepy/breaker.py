@@ -0,0 +1,101 @@
+"""
+Sleepy Circuit Breaker
+
+Keeps the state of the circuit breakers the CircuitBreaker decorator
+puts in front of handlers. The state lives in the cache so every worker
+sees the same breaker:
+
+- closed, calls go through. Failures are counted per window and once
+  failure_threshold calls fail within window seconds the breaker trips.
+- open, for reset_timeout seconds after the breaker trips calls fail
+  fast without running.
+- half open, once reset_timeout has passed one call every
+  probe_interval seconds is let through as a probe. A successful probe
+  closes the breaker, a failed one opens it again.
+"""
+
+# Thirdparty imports
+from django.conf import settings
+from django.core.cache import cache
+
+BREAKER_PREFIX = getattr(settings, 'SLEEPY_BREAKER_PREFIX', 'sleepy:breaker:')
+
+# How long a tripped breaker remembers it tripped, half open breakers
+# that aren't probed for this long close
+BREAKER_MEMORY = 60 * 60 * 24
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class Breaker(object):
+    """
+    The shared state of one circuit breaker
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=5,
+        window=60,
+        reset_timeout=30,
+        probe_interval=5):
+
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+
+        key = BREAKER_PREFIX + name
+        self.open_key = key + ':open'
+        self.tripped_key = key + ':tripped'
+        self.failures_key = key + ':failures'
+        self.probe_key = key + ':probe'
+
+    def state(self):
+        flags = cache.get_many([self.open_key, self.tripped_key])
+        if self.open_key in flags:
+            return OPEN
+        if self.tripped_key in flags:
+            return HALF_OPEN
+        return CLOSED
+
+    def allow(self, state):
+        """
+        Returns True if a call may go through in the given state, half
+        open breakers let one probe through per probe_interval
+        """
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        return cache.add(self.probe_key, 1, self.probe_interval)
+
+    def trip(self):
+        cache.set(self.open_key, 1, self.reset_timeout)
+        cache.set(self.tripped_key, 1, BREAKER_MEMORY)
+        cache.delete(self.failures_key)
+
+    def record_success(self, state):
+        if state == HALF_OPEN:
+            cache.delete_many([
+                self.tripped_key,
+                self.failures_key,
+                self.probe_key
+            ])
+
+    def record_failure(self, state):
+        if state == HALF_OPEN:
+            self.trip()
+            return
+
+        cache.add(self.failures_key, 0, self.window)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # The window ended between add and incr
+            failures = 1
+
+        if failures >= self.failure_threshold:
+            self.trip()
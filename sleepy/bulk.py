@@ -0,0 +1,232 @@
+"""
+Sleepy Bulk Writes
+
+Lets clients send many items in one request. A handler lists the
+methods that accept bulk writes in bulk_methods, a request to one of
+them whose body is a JSON array is then dispatched once per item, with
+the item's keys as keyword arguments. Decorators such as ParameterType
+and ParameterAssert validate each item on its own.
+
+Handlers pass the instances they write to save() instead of saving them
+directly. Outside of a bulk request save() saves the instance, in a bulk
+request it queues the instance and the queued writes are flushed once
+every item has been dispatched: new instances with one bulk_create per
+model and updates with one UPDATE per model and set of values. Updates
+set auto_now fields like save() does, and items updating a row that
+doesn't exist fail with a 404. The items and the flush run in a single
+transaction.
+
+The response holds the status and body of each item's response in the
+order the items were sent:
+
+    {"data": [{"status": 201, "data": {...}},
+              {"status": 400, "error": {...}}],
+     "succeeded": 1,
+     "failed": 1}
+"""
+
+# Universe imports
+import json
+from datetime import date
+from collections import OrderedDict
+
+# Thirdparty imports
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, DateTimeField
+from django.utils import timezone
+
+# Akimbo imports
+from responses import api_error, api_out
+from patching import media_type
+import context
+import sync
+
+# The most items a bulk request may hold, handlers can override it with
+# their bulk_max_items attribute
+BULK_MAX_ITEMS = getattr(settings, 'SLEEPY_BULK_MAX_ITEMS', 500)
+
+
+class BulkWriter(object):
+    """
+    Collects the writes of a bulk request, see save()
+    """
+
+    def __init__(self):
+        # model -> [instance]
+        self.creates = OrderedDict()
+        # (model, fields, values) -> {pk: [item position]}
+        self.updates = OrderedDict()
+        # The position of the item being dispatched
+        self.position = None
+
+    def create(self, instance):
+        self.creates.setdefault(instance.__class__, []).append(instance)
+
+    def update(self, instance, fields):
+        fields = tuple(fields)
+        values = tuple(getattr(instance, field) for field in fields)
+        key = (instance.__class__, fields, values)
+        positions = self.updates.setdefault(key, {})
+        positions.setdefault(instance.pk, []).append(self.position)
+
+    def flush(self):
+        """
+        Writes the queued instances and returns the positions of the
+        items whose rows didn't exist
+        """
+        missing = []
+
+        for model, instances in self.creates.items():
+            model._default_manager.bulk_create(instances)
+            sync.changed(model)
+
+        for (model, fields, values), positions in self.updates.items():
+            rows = model._default_manager.filter(pk__in=positions.keys())
+
+            # update() doesn't run pre_save, so it doesn't touch auto_now
+            # fields the way save() does
+            changes = _auto_now_values(model, fields)
+            changes.update(zip(fields, values))
+
+            if rows.update(**changes) < len(positions):
+                found = set(rows.values_list('pk', flat=True))
+                for pk, item_positions in positions.items():
+                    if pk not in found:
+                        missing.extend(item_positions)
+
+            sync.changed(model)
+
+        self.creates.clear()
+        self.updates.clear()
+        return sorted(missing)
+
+
+def _auto_now_values(model, fields):
+    now = timezone.now()
+    values = {}
+    for field in model._meta.local_fields:
+        if not getattr(field, 'auto_now', False) or field.name in fields:
+            continue
+        if isinstance(field, DateTimeField):
+            values[field.name] = now
+        elif isinstance(field, DateField):
+            values[field.name] = date.today()
+    return values
+
+
+def save(request, instance, update_fields=None):
+    """
+    Saves instance, or queues it when request is a bulk request. Pass
+    update_fields to update those fields of an existing row, without it
+    the instance is created.
+    """
+    writer = getattr(request, 'bulk', None)
+
+    if writer is None:
+        instance.save(update_fields=update_fields)
+    elif update_fields is None:
+        writer.create(instance)
+    else:
+        writer.update(instance, update_fields)
+
+
+def bulk_items(request):
+    """
+    Returns the items of a bulk request or None when the request's body
+    isn't a JSON array
+    """
+    if media_type(request) != 'application/json':
+        return None
+
+    if not request.body.lstrip().startswith('['):
+        return None
+
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        return None
+
+
+def _item_result(response):
+    result = {'status': response.status_code}
+    if getattr(response, 'streaming', False):
+        return result
+
+    try:
+        result.update(json.loads(response.content))
+    except ValueError:
+        pass
+    return result
+
+
+def dispatch(handler, items, request, *args, **kwargs):
+    """
+    Dispatches each item of a bulk request to handler and returns the
+    per item results, see the module documentation
+    """
+    if len(items) > handler.bulk_max_items:
+        return api_error(
+            "bulk requests may hold at most {0} items".format(
+                handler.bulk_max_items
+            ),
+            "Request Entity Too Large",
+            413
+        )
+
+    results = []
+    request.bulk = BulkWriter()
+
+    # Item responses are rendered as plain JSON whatever the client
+    # asked for, only the envelope is negotiated
+    outer_request = context.set_current_request(None)
+    try:
+        with transaction.commit_on_success():
+            for position, item in enumerate(items):
+                request.bulk.position = position
+                if not isinstance(item, dict):
+                    results.append({
+                        'status': 400,
+                        'error': {
+                            'message': "bulk items must be objects",
+                            'type': "Parameter Error"
+                        }
+                    })
+                    continue
+
+                item_kwargs = dict(kwargs)
+                item_kwargs.update(item)
+                results.append(_item_result(
+                    handler._dispatch(request, *args, **item_kwargs)
+                ))
+
+            for position in request.bulk.flush():
+                results[position] = {
+                    'status': 404,
+                    'error': {
+                        'message': "the row to update doesn't exist",
+                        'type': "Not Found"
+                    }
+                }
+
+        rolled_back = None
+
+    except IntegrityError as e:
+        rolled_back = e
+
+    finally:
+        context.set_current_request(outer_request)
+        request.bulk = None
+
+    if rolled_back is not None:
+        return api_error(
+            "the bulk write was rolled back: {0}".format(rolled_back),
+            "Integrity Error",
+            409
+        )
+
+    failed = sum(1 for result in results if result['status'] >= 400)
+    return api_out(
+        results,
+        {'succeeded': len(results) - failed, 'failed': failed}
+    )
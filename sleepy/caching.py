@@ -0,0 +1,467 @@
+"""
+Sleepy Caching
+
+Helpers shared by the caching decorators. They build the canonical
+cache key for a request and keep a generation counter per cache tag.
+The generations of an entry's tags are folded into its key, so
+incrementing a tag's generation invalidates every entry carrying that
+tag without having to enumerate the keys.
+"""
+
+# Universe imports
+import copy
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+
+# Thirdparty imports
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_connection
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import HttpRequest
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+# Akimbo imports
+import context
+import deadlines
+from profiling import PROFILE_PARAM
+from renderers import JSON_RENDERER, renderer_for_request
+from serialization import serialize_rows
+
+CACHE_TAG_PREFIX = getattr(settings, 'SLEEPY_CACHE_TAG_PREFIX', 'sleepy:tag:')
+
+# The header CacheResponse lists a response's tags in so that a reverse
+# proxy or CDN can purge by tag
+SURROGATE_KEY_HEADER = getattr(
+    settings,
+    'SLEEPY_SURROGATE_KEY_HEADER',
+    'Surrogate-Key'
+)
+
+FRAGMENT_CACHE_PREFIX = getattr(
+    settings,
+    'SLEEPY_FRAGMENT_CACHE_PREFIX',
+    'sleepy:row:'
+)
+
+FRAGMENT_CACHE_TIMEOUT = getattr(
+    settings,
+    'SLEEPY_FRAGMENT_CACHE_TIMEOUT',
+    60 * 60 * 24
+)
+
+# Rows that miss the fragment cache are fetched with pk__in queries of
+# at most this many ids, sqlite refuses more than 999 parameters
+FRAGMENT_QUERY_CHUNK_SIZE = 500
+
+MULTIGET_CACHE_PREFIX = getattr(
+    settings,
+    'SLEEPY_MULTIGET_CACHE_PREFIX',
+    'sleepy:id:'
+)
+
+# Tag generations have to outlive every entry tagged with them
+CACHE_TAG_TIMEOUT = getattr(
+    settings,
+    'SLEEPY_CACHE_TAG_TIMEOUT',
+    60 * 60 * 24 * 30
+)
+
+# Seconds the caller refreshing a stale entry holds its lock for, other
+# callers serve the stale entry meanwhile
+CACHE_LOCK_TIMEOUT = getattr(settings, 'SLEEPY_CACHE_LOCK_TIMEOUT', 10)
+
+# Seconds CacheResponse keeps serving an entry after it goes stale while
+# one caller refreshes it
+CACHE_STALE_GRACE = getattr(settings, 'SLEEPY_CACHE_STALE_GRACE', 30)
+
+CACHE_LOCK_SUFFIX = ':lock'
+
+
+def find_request(args):
+    """
+    Returns the first HttpRequest in a decorated function's positional
+    arguments or None if there isn't one
+    """
+    for arg in args:
+        if isinstance(arg, HttpRequest):
+            return arg
+    return None
+
+
+def request_cache_key(request, include_user=False, extra=""):
+    """
+    Returns the canonical cache key for a request, an md5 of its path,
+    its sorted parameters and optionally the requesting user
+    """
+    request_keys = request.REQUEST.keys()
+    request_keys.sort()
+    cache_key_string = request.path.strip("/")
+    for key in request_keys:
+        # Profiling a request doesn't change its response
+        if key == PROFILE_PARAM:
+            continue
+        cache_key_string += "{0}={1}".format(key, request.REQUEST[key])
+
+    # Include the user if we need to, requests that didn't go through
+    # the authentication middleware have none
+    user = getattr(request, 'user', None)
+    if include_user and user is not None and not user.is_anonymous():
+        cache_key_string += "{0}={1}".format("_user", user.pk)
+
+    cache_key_string += extra
+
+    md5 = hashlib.md5()
+    md5.update(cache_key_string)
+    return md5.hexdigest()
+
+
+def representation_key_suffix(request):
+    """
+    Returns the string folded into a cache key so that every
+    representation of a response (see sleepy.renderers) is cached
+    separately. JSON responses keep their unsuffixed keys.
+    """
+    renderer = renderer_for_request(request)
+    if renderer is JSON_RENDERER:
+        return ""
+
+    return "_format=" + renderer.name
+
+
+def format_tags(tags, args, kwargs):
+    """
+    Expands a decorator's tags for one call. Strings are formatted with
+    the handler's keyword arguments ("story:{id}") and callables are
+    called with the handler's arguments and may return a tag or a list
+    of tags. Tags that refer to a missing argument are dropped.
+    """
+    formatted = []
+    for tag in tags:
+        if callable(tag):
+            tag = tag(*args, **kwargs)
+            if tag is None:
+                continue
+            if isinstance(tag, (list, tuple, set)):
+                formatted.extend(tag)
+                continue
+        else:
+            try:
+                tag = tag.format(**kwargs)
+            except KeyError:
+                continue
+        formatted.append(tag)
+    return formatted
+
+
+def tag_generations(tags):
+    """
+    Returns the current generation of each tag, starting a generation
+    for tags that don't have one yet. Generations start at the current
+    time in milliseconds so that a tag whose counter was evicted never
+    reuses an old generation.
+    """
+    keys = [CACHE_TAG_PREFIX + tag for tag in tags]
+    generations = cache.get_many(keys)
+
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time() * 1000), CACHE_TAG_TIMEOUT)
+            generations[key] = cache.get(key)
+
+    return [generations[key] for key in keys]
+
+
+def tagged_key_suffix(tags):
+    """
+    Returns the string folded into a cache key for the given tags
+    """
+    if not tags:
+        return ""
+
+    return "_tags=" + ",".join(
+        "{0}:{1}".format(tag, generation)
+        for tag, generation
+        in zip(tags, tag_generations(tags)))
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidates every cache entry carrying any of the given tags
+    """
+    for tag in tags:
+        try:
+            cache.incr(CACHE_TAG_PREFIX + tag)
+        except ValueError:
+            # The tag has no generation so nothing is cached under it
+            pass
+
+
+def should_refresh(soft_expiry, delta, early_refresh=None):
+    """
+    Returns True when an entry should be recomputed: once its soft
+    expiry has passed or, with early_refresh, at random before that with
+    a probability that grows as the expiry nears and with the time the
+    entry took to compute (delta). early_refresh is the beta of
+    probabilistic early expiration ("XFetch"), 1.0 is a good start and
+    larger values refresh earlier.
+    """
+    now = time.time()
+    if now >= soft_expiry:
+        return True
+
+    if not early_refresh:
+        return False
+
+    # 1 - random() is in (0, 1] so the logarithm is defined
+    return now - delta * early_refresh * math.log(1.0 - random.random()) >= soft_expiry
+
+
+def acquire_refresh_lock(cache_key):
+    """
+    Returns True for the one caller that gets to refresh cache_key
+    """
+    return cache.add(cache_key + CACHE_LOCK_SUFFIX, 1, CACHE_LOCK_TIMEOUT)
+
+
+def release_refresh_lock(cache_key):
+    cache.delete(cache_key + CACHE_LOCK_SUFFIX)
+
+
+def _refresh(request, work, cache_key):
+    context.set_current_request(request)
+    try:
+        work()
+    except Exception:
+        # The stale entry stays until its hard expiry, the next caller
+        # past the lock tries again
+        pass
+    finally:
+        release_refresh_lock(cache_key)
+        context.set_current_request(None)
+        close_connection()
+
+
+def refresh_request(request, timeout):
+    """
+    Returns a copy of request to recompute an entry with in the
+    background. The copy gets a deadline of its own from timeout, the
+    request's deadline (and the client's X-Request-Timeout) only bound
+    the request that was served the stale entry.
+    """
+    fresh = copy.copy(request)
+    fresh.META = dict(request.META)
+    fresh.META.pop(deadlines.TIMEOUT_HEADER, None)
+    fresh.deadline = None
+    deadlines.start(fresh, timeout)
+    return fresh
+
+
+def refresh_in_background(request, work, cache_key):
+    """
+    Runs work, which recomputes the entry for cache_key, in a thread of
+    its own and releases the entry's refresh lock when it's done
+    """
+    thread = threading.Thread(
+        target=_refresh,
+        args=(request, work, cache_key),
+        name="sleepy-cache-refresh"
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def patch_http_cache_headers(
+    response,
+    duration,
+    include_user=False,
+    stale_while_revalidate=0,
+    tags=None):
+    """
+    Adds the Cache-Control, Vary and surrogate key headers that let
+    clients and shared caches reuse a response for as long as the
+    server side cache would. Responses that depend on the user are
+    only cacheable by the client.
+    """
+    if response.status_code != 200:
+        return response
+
+    directives = {'max_age': duration}
+    if stale_while_revalidate:
+        directives['stale_while_revalidate'] = stale_while_revalidate
+
+    if include_user:
+        directives['private'] = True
+    else:
+        directives['public'] = True
+
+    patch_cache_control(response, **directives)
+
+    # The representation is negotiated from the Accept header, and Base
+    # echoes the request's Origin in Access-Control-Allow-Origin
+    vary = ['Accept']
+    if getattr(settings, 'CORS_SHARING_ALLOWED_ORIGINS', ['*']):
+        vary.append('Origin')
+    if include_user:
+        vary.extend(['Authorization', 'Cookie'])
+    if ('django.middleware.gzip.GZipMiddleware'
+            in getattr(settings, 'MIDDLEWARE_CLASSES', ())):
+        vary.append('Accept-Encoding')
+    patch_vary_headers(response, vary)
+
+    if tags and not include_user:
+        response[SURROGATE_KEY_HEADER] = " ".join(tags)
+
+    return response
+
+
+def model_label(model):
+    """
+    Returns the "app_label.model_name" label of a model class
+    """
+    return "{0}.{1}".format(
+        model._meta.app_label,
+        model._meta.object_name.lower()
+    )
+
+
+def row_fragments(queryset, version_field, duration=FRAGMENT_CACHE_TIMEOUT):
+    """
+    Returns the JSON encoded as_dict of every row in queryset, in
+    order. Each row's JSON is cached under its model, pk and the value
+    of version_field (a column such as updated_at that changes
+    whenever the row does). Only rows that miss the cache are read and
+    serialized, all cache reads and writes are done in bulk.
+    """
+    label = model_label(queryset.model)
+
+    keys = []
+    for pk, version in queryset.values_list('pk', version_field):
+        if version is None:
+            # Rows without a version can't be cached safely
+            keys.append((pk, None))
+            continue
+
+        if hasattr(version, 'isoformat'):
+            version = version.isoformat()
+
+        keys.append((
+            pk,
+            "{0}{1}:{2}:{3}".format(
+                FRAGMENT_CACHE_PREFIX,
+                label,
+                pk,
+                str(version).replace(" ", "_")
+            )
+        ))
+
+    fragments = cache.get_many([key for _, key in keys if key is not None])
+
+    # Load and encode the rows that missed the cache
+    rendered = {}
+    missing = [pk for pk, key in keys if key not in fragments]
+    if missing:
+        if queryset.query.can_filter():
+            source = queryset.order_by()
+        else:
+            source = queryset.model._default_manager.all()
+
+        for ii in range(0, len(missing), FRAGMENT_QUERY_CHUNK_SIZE):
+            chunk = missing[ii:ii + FRAGMENT_QUERY_CHUNK_SIZE]
+            for pk, row in serialize_rows(source.filter(pk__in=chunk)):
+                rendered[pk] = json.dumps(row)
+
+        cache.set_many(
+            dict(
+                (key, rendered[pk])
+                for pk, key
+                in keys
+                if key is not None and pk in rendered),
+            duration
+        )
+
+    # Rows deleted since we listed the queryset are dropped
+    return [
+        rendered[pk] if pk in rendered else fragments[key]
+        for pk, key
+        in keys
+        if pk in rendered or key in fragments]
+
+
+def query_digest(queryset):
+    """
+    Returns an md5 of queryset's SQL, or None when queryset can't
+    contain any rows
+    """
+    if isinstance(queryset, EmptyQuerySet):
+        return None
+
+    try:
+        sql = unicode(queryset.query)
+    except EmptyResultSet:
+        return None
+
+    return hashlib.md5(sql.encode('utf-8')).hexdigest()
+
+
+def rows_by_id(queryset, ids, duration=None, tag=None):
+    """
+    Returns the serialized row (see sleepy.serialization) of each id in
+    ids, in order, with None for ids queryset doesn't contain. Rows
+    that aren't cached are read with pk__in queries.
+
+    With duration each row is cached for duration seconds under its
+    model, id and a digest of queryset's SQL, so querysets filtering
+    out some rows (deleted rows or other users' rows, say) never see
+    rows cached for broader ones. tag is formatted with the id ("story:{id}") and its
+    generation is part of the row's key, so invalidating the tag (for
+    instance with InvalidatesTags) expires the row along with the
+    responses CacheResponse cached under the same tag.
+    """
+    digest = query_digest(queryset)
+    if digest is None:
+        return [None for pk in ids]
+
+    label = model_label(queryset.model)
+
+    keys = {}
+    if duration is not None:
+        tags = [tag.format(id=pk) for pk in ids] if tag else []
+        generations = dict(zip(tags, tag_generations(tags)))
+        for pk in ids:
+            key = "{0}{1}:{2}:{3}".format(
+                MULTIGET_CACHE_PREFIX, label, digest, pk)
+            if tag:
+                tag_name = tag.format(id=pk)
+                key += "_tags={0}:{1}".format(tag_name, generations[tag_name])
+            keys[pk] = key
+
+    cached = cache.get_many(keys.values()) if keys else {}
+    rows = dict(
+        (pk, cached[key])
+        for pk, key
+        in keys.items()
+        if key in cached)
+
+    missing = [pk for pk in ids if pk not in rows]
+    if missing:
+        loaded = {}
+        for ii in range(0, len(missing), FRAGMENT_QUERY_CHUNK_SIZE):
+            chunk = missing[ii:ii + FRAGMENT_QUERY_CHUNK_SIZE]
+            for pk, row in serialize_rows(queryset.filter(pk__in=chunk)):
+                loaded[pk] = row
+
+        if keys and loaded:
+            cache.set_many(
+                dict((keys[pk], row) for pk, row in loaded.items()),
+                duration
+            )
+        rows.update(loaded)
+
+    return [rows.get(pk) for pk in ids]
@@ -0,0 +1,110 @@
+"""
+Sleepy Request Coalescing
+
+Makes concurrent identical work run once per worker process. The first
+caller for a key runs the work while callers arriving for the same key
+in the meantime wait for it to finish and get a copy of its result,
+instead of each doing the same database work during a burst. Callers
+that wait longer than their timeout do the work themselves.
+
+The Coalesce decorator and the coalesce option of CacheResponse key
+the work on the canonical request key (see
+sleepy.caching.request_cache_key).
+"""
+
+# Universe imports
+import sys
+import cPickle as pickle
+import threading
+
+# Thirdparty imports
+from django.conf import settings
+
+# Seconds a caller waits for another caller's result before doing the
+# work itself
+COALESCE_TIMEOUT = getattr(settings, 'SLEEPY_COALESCE_TIMEOUT', 10)
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Flight(object):
+    """
+    The work being done for one key
+    """
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        # Callers waiting for the result, changed under _flights_lock
+        self.waiters = 0
+        # The pickled result, None when it can't be shared
+        self.result = None
+        self.error = None
+
+
+def _share(result):
+    # Every waiter gets its own copy because Base keeps changing the
+    # response after the handler returns it
+    if getattr(result, 'streaming', False):
+        return None
+
+    try:
+        return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError):
+        return None
+
+
+def _land(key, flight):
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+
+def in_flight(key):
+    """
+    Returns True while work is being done for key
+    """
+    return key in _flights
+
+
+def run(key, work, timeout=COALESCE_TIMEOUT):
+    """
+    Returns work(), or a copy of the result of the work another thread
+    is already doing for key. Exceptions raised by the work are raised
+    in every caller that waited for it.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leading = flight is None
+        if leading:
+            flight = _flights[key] = _Flight()
+        else:
+            flight.waiters += 1
+
+    if leading:
+        try:
+            result = work()
+            # Nobody can start waiting once the flight has landed, so
+            # the result is only copied when someone already waits
+            _land(key, flight)
+            if flight.waiters:
+                flight.result = _share(result)
+            return result
+        except Exception:
+            flight.error = sys.exc_info()
+            raise
+        finally:
+            _land(key, flight)
+            flight.done.set()
+
+    if not flight.done.wait(timeout):
+        return work()
+
+    if flight.error is not None:
+        raise flight.error[0], flight.error[1], flight.error[2]
+
+    if flight.result is None:
+        return work()
+
+    return pickle.loads(flight.result)
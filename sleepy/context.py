@@ -0,0 +1,30 @@
+"""
+Sleepy Request Context
+
+Keeps the request a Base handler is serving in a thread local so that
+response helpers and decorators further down the call stack can look
+at it without it being passed through every call.
+"""
+
+# Universe imports
+import threading
+
+_local = threading.local()
+
+
+def current_request():
+    """
+    Returns the request being served by this thread or None outside of
+    a Base handler
+    """
+    return getattr(_local, 'request', None)
+
+
+def set_current_request(request):
+    """
+    Makes request the current request for this thread and returns the
+    previous one so that it can be restored
+    """
+    previous = getattr(_local, 'request', None)
+    _local.request = request
+    return previous
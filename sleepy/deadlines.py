@@ -0,0 +1,171 @@
+"""
+Sleepy Deadlines
+
+Gives every request a time budget. Base sets a deadline when a request
+arrives from the handler's timeout attribute (SLEEPY_REQUEST_TIMEOUT by
+default) and the client's X-Request-Timeout header, whichever is
+shorter. A request whose budget runs out while it waits for admission
+is answered with a 503 before its handler runs. Handler code that finds
+the deadline has passed raises DeadlineExceeded, which Base turns into
+a 504, instead of finishing work nobody will read.
+
+Handler code, decorators and the cache layer ask how much of the budget
+is left with remaining() and bound the calls they make with it:
+
+    response = urllib2.urlopen(url, timeout=deadlines.timeout_for(10))
+
+    with deadlines.bounded_queries():
+        rows = list(expensive_queryset)
+
+Requests without a deadline pay for one attribute lookup.
+"""
+
+# Universe imports
+import time
+from contextlib import contextmanager
+
+# Thirdparty imports
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+# Akimbo imports
+from context import current_request
+
+# Seconds a request may take, None gives requests no deadline unless the
+# client sends one
+REQUEST_TIMEOUT = getattr(settings, 'SLEEPY_REQUEST_TIMEOUT', None)
+
+# Clients may shorten, but never lengthen, their request's budget
+TIMEOUT_HEADER = 'HTTP_X_REQUEST_TIMEOUT'
+
+# How many sqlite virtual machine instructions run between deadline
+# checks in bounded_queries
+SQLITE_CHECK_INTERVAL = 10000
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request has run out of time
+    """
+    pass
+
+
+def start(request, timeout):
+    """
+    Sets the deadline of a request from the handler's timeout and the
+    client's header. A request that already has a deadline, because one
+    handler called another, keeps it.
+    """
+    if getattr(request, 'deadline', None) is not None:
+        return request.deadline
+
+    try:
+        client_timeout = float(request.META[TIMEOUT_HEADER])
+    except (KeyError, ValueError):
+        client_timeout = None
+
+    if client_timeout is not None and client_timeout > 0:
+        if timeout is None or client_timeout < timeout:
+            timeout = client_timeout
+
+    if timeout is None:
+        request.deadline = None
+    else:
+        request.deadline = time.time() + timeout
+
+    return request.deadline
+
+
+def remaining(request=None):
+    """
+    Returns the seconds left in the budget of a request (by default the
+    request being served), None when it has no deadline
+    """
+    if request is None:
+        request = current_request()
+
+    deadline = getattr(request, 'deadline', None)
+    if deadline is None:
+        return None
+
+    return deadline - time.time()
+
+
+def expired(request=None):
+    left = remaining(request)
+    return left is not None and left <= 0
+
+
+def check(request=None):
+    """
+    Raises DeadlineExceeded if the request has run out of time
+    """
+    if expired(request):
+        raise DeadlineExceeded()
+
+
+def timeout_for(timeout=None, request=None):
+    """
+    Returns the timeout to give a call made for the request, the
+    smaller of timeout and the time left. Raises DeadlineExceeded when
+    no time is left.
+    """
+    left = remaining(request)
+    if left is None:
+        return timeout
+
+    if left <= 0:
+        raise DeadlineExceeded()
+
+    if timeout is None:
+        return left
+
+    return min(timeout, left)
+
+
+@contextmanager
+def bounded_queries(using=DEFAULT_DB_ALIAS, request=None):
+    """
+    Aborts database queries run inside the block once the request runs
+    out of time, the aborted query raises DeadlineExceeded. Queries are
+    bounded with statement_timeout on PostgreSQL, max_execution_time on
+    MySQL and a progress handler on sqlite.
+    """
+    left = timeout_for(None, request)
+    if left is None:
+        yield
+        return
+
+    connection = connections[using]
+    cursor = connection.cursor()
+    vendor = connection.vendor
+    deadline = time.time() + left
+
+    if vendor == 'postgresql':
+        cursor.execute("SET statement_timeout = %s", [int(left * 1000)])
+    elif vendor == 'mysql':
+        cursor.execute("SET SESSION max_execution_time = %s", [int(left * 1000)])
+    elif vendor == 'sqlite':
+        connection.connection.set_progress_handler(
+            lambda: time.time() > deadline,
+            SQLITE_CHECK_INTERVAL
+        )
+
+    try:
+        yield
+    except Exception:
+        if time.time() > deadline:
+            raise DeadlineExceeded()
+        raise
+    finally:
+        try:
+            if vendor == 'postgresql':
+                cursor.execute("SET statement_timeout = DEFAULT")
+            elif vendor == 'mysql':
+                cursor.execute("SET SESSION max_execution_time = DEFAULT")
+            elif vendor == 'sqlite':
+                connection.connection.set_progress_handler(None, 0)
+        except Exception:
+            # An aborted query can leave the transaction unusable, the
+            # connection is closed at the end of the request anyway
+            pass
@@ -15,15 +15,32 @@ __author__ = "Adam Haney <adam.haney@akimbo.io>"
 __license__ = "Copyright (c) 2011 akimbo, LLC"
 
 # Universe imports
-import hashlib
+import math
+import time
+import functools
 
 # Thirdparty imports
 from django.utils.decorators import wraps
-from django.http import HttpRequest
 from django.core.cache import cache
 
 # Akimbo imports
-from sleepy.responses import api_error
+from sleepy import breaker, coalescing, deadlines
+from sleepy.responses import MULTIGET_MAX_IDS, api_error, wants_ndjson
+from sleepy.caching import (
+    CACHE_STALE_GRACE,
+    acquire_refresh_lock,
+    find_request,
+    format_tags,
+    invalidate_tags,
+    patch_http_cache_headers,
+    refresh_in_background,
+    refresh_request,
+    release_refresh_lock,
+    representation_key_suffix,
+    request_cache_key,
+    should_refresh,
+    tagged_key_suffix
+)
 
 
 def RequiresParameters(params):
@@ -142,6 +159,56 @@ def ParameterTransform(param, func):
     return _wrap
 
 
+def AcceptsIds(param="ids", type_=int, max_ids=None):
+    """
+    Parses the ids a multi-get request asks for, either comma separated
+    (ids=1,2,3) or repeated (ids=1&ids=2), into a list of type_ passed
+    to the decorated method as the param keyword argument. Duplicates
+    are dropped. Requests for more than max_ids ids
+    (SLEEPY_MULTIGET_MAX_IDS by default) are refused. Requests without
+    the parameter are passed through untouched.
+    """
+    def _wrap(fn):
+        def _accepts_ids(self, request, *args, **kwargs):
+            values = request.GET.getlist(param)
+            if not values:
+                return fn(self, request, *args, **kwargs)
+
+            limit = max_ids if max_ids is not None else MULTIGET_MAX_IDS
+
+            ids = []
+            seen = set()
+            for value in values:
+                for raw_id in value.split(","):
+                    raw_id = raw_id.strip()
+                    if not raw_id:
+                        continue
+                    try:
+                        id_ = type_(raw_id)
+                    except ValueError:
+                        return api_error(
+                            "{0} must be a list of {1}".format(param, type_),
+                            "Parameter Error"
+                        )
+                    if id_ not in seen:
+                        seen.add(id_)
+                        ids.append(id_)
+
+            if len(ids) > limit:
+                return api_error(
+                    "at most {0} {1} can be fetched at once".format(
+                        limit,
+                        param
+                    ),
+                    "Parameter Error"
+                )
+
+            kwargs[param] = ids
+            return fn(self, request, *args, **kwargs)
+        return _accepts_ids
+    return _wrap
+
+
 def AbsolutePermalink(func, protocol="https://"):
     from django.core.urlresolvers import reverse
     from django.contrib.sites.models import Site
@@ -155,47 +222,326 @@ def AbsolutePermalink(func, protocol="https://"):
     return inner
 
 
-def CacheResponse(duration, include_user=False):
+def CacheResponse(
+    duration,
+    include_user=False,
+    tags=None,
+    http_cache=False,
+    stale_while_revalidate=0,
+    coalesce=False,
+    background_refresh=False,
+    early_refresh=None,
+    stale_grace=CACHE_STALE_GRACE):
+    """
+    Caches the response of the decorated method for duration seconds,
+    keyed on the request path, its parameters and optionally the user.
+    Each representation of the response (see sleepy.renderers) is
+    cached separately.
+
+    tags are strings formatted with the method's keyword arguments
+    ("story:{id}") or callables. Every generation of the response's
+    tags is part of its cache key, so calling
+    sleepy.caching.invalidate_tags (or decorating a write method with
+    InvalidatesTags) expires all responses carrying a tag at once.
+
+    With http_cache the response also carries Cache-Control and Vary
+    headers for the same duration and its tags as surrogate keys, so
+    clients and reverse proxies can cache it too. stale_while_revalidate
+    adds the Cache-Control directive of the same name.
+
+    Entries go stale after duration seconds and are dropped stale_grace
+    seconds later (SLEEPY_CACHE_STALE_GRACE by default). The first
+    caller to find an entry stale takes a short lock (see
+    sleepy.caching.CACHE_LOCK_TIMEOUT) and recomputes it, in a
+    background thread with background_refresh, while every other caller
+    is served the stale entry. early_refresh
+    recomputes entries at random shortly before they go stale instead,
+    see sleepy.caching.should_refresh.
+
+    With coalesce, concurrent misses for the same key in one worker
+    compute the response once (see sleepy.coalescing).
+    """
+    tags = tags or ()
+
     def _wrap(fn):
+        def _cache_key(request, args, kwargs):
+            formatted_tags = format_tags(tags, args, kwargs)
+            cache_key = request_cache_key(
+                request,
+                include_user,
+                tagged_key_suffix(formatted_tags)
+                + representation_key_suffix(request)
+            )
+            return cache_key, formatted_tags
+
+        def _cached_response(*args, **kwargs):
+            """
+            Returns the cached response for a call, stale or not, or None
+            """
+            request = find_request(args)
+            if request is None or wants_ndjson(request):
+                return None
+
+            entry = cache.get(_cache_key(request, args, kwargs)[0])
+            if isinstance(entry, tuple):
+                return entry[0]
+            return entry
+
         def _cacher(*args, **kwargs):
             # See if we can find the http request in the args
-            request = None
-            for arg in args:
-                if(isinstance(arg, HttpRequest)):
-                    request = arg
-                    break
+            request = find_request(args)
 
-            # If we didnt find the request just run the original
-            if request is None:
+            # If we didnt find the request just run the original, the
+            # same goes for streamed responses which can't be cached
+            if request is None or wants_ndjson(request):
                 return fn(*args, **kwargs)
 
             # Create the cache key
-            request_keys = request.REQUEST.keys()
-            request_keys.sort()
-            cache_key_string = request.path.strip("/")
-            for key in request_keys:
-                cache_key_string += "{0}={1}".format(key, request.REQUEST[key])
-            md5 = hashlib.md5()
-
-            # Include the user if we need to
-            if include_user and not request.user.is_anonymous():
-                cache_key_string += "{0}={1}".format("_user", request.user.pk)
+            cache_key, formatted_tags = _cache_key(request, args, kwargs)
+
+            def _compute(args=args):
+                started = time.time()
+                response = fn(*args, **kwargs)
+                computed_at = time.time()
+
+                if http_cache:
+                    patch_http_cache_headers(
+                        response,
+                        duration,
+                        include_user,
+                        stale_while_revalidate,
+                        formatted_tags
+                    )
+                    response.cached_at = computed_at
+
+                # Cache the response along with when it goes stale and
+                # how long it took to compute. Server errors aren't
+                # cached so that a stale copy is always a good response.
+                if (response.status_code < 500
+                        and not getattr(response, 'streaming', False)):
+                    cache.set(
+                        cache_key,
+                        (response, computed_at + duration, computed_at - started),
+                        duration + stale_grace
+                    )
 
-            md5.update(cache_key_string)
-            cache_key = md5.hexdigest()
+                return response
 
             # Check if the cache key exists
-            if cache.get(cache_key) is not None:
-                return cache.get(cache_key)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                if not isinstance(entry, tuple):
+                    # Entries cached before they carried a soft expiry
+                    entry = (entry, float('inf'), 0)
+                response, soft_expiry, delta = entry
+
+                if (should_refresh(soft_expiry, delta, early_refresh)
+                        and acquire_refresh_lock(cache_key)):
+                    if background_refresh:
+                        # The handler runs again for a request of its own,
+                        # this one is answered with the stale entry
+                        fresh = refresh_request(
+                            request,
+                            getattr(args[0], 'timeout', deadlines.REQUEST_TIMEOUT)
+                        )
+                        refresh_in_background(
+                            fresh,
+                            functools.partial(
+                                _compute,
+                                tuple(fresh if arg is request else arg
+                                      for arg in args)
+                            ),
+                            cache_key
+                        )
+                    else:
+                        try:
+                            return _compute()
+                        finally:
+                            release_refresh_lock(cache_key)
+
+                if http_cache:
+                    # Let downstream caches know how long the response
+                    # has already been cached for
+                    now = time.time()
+                    response['Age'] = int(
+                        now - getattr(response, 'cached_at', now)
+                    )
+                return response
 
-            # Cache the response
+            # Hits are served whatever the budget, a miss isn't worth
+            # computing for a request that has run out of time
+            deadlines.check(request)
+
+            if coalesce:
+                return coalescing.run(
+                    cache_key,
+                    _compute,
+                    deadlines.timeout_for(coalescing.COALESCE_TIMEOUT, request)
+                )
+
+            return _compute()
+
+        # Lets CircuitBreaker fall back to the last cached response
+        _cacher.cached_response = _cached_response
+        return _cacher
+    return _wrap
+
+
+def InvalidatesTags(*tags):
+    """
+    Invalidates the cached responses carrying any of the given tags
+    (see CacheResponse) after the decorated method succeeds. Tags are
+    formatted with the method's keyword arguments.
+    """
+    def _wrap(fn):
+        def _tag_invalidator(*args, **kwargs):
             response = fn(*args, **kwargs)
-            cache.set(cache_key, response, duration)
+            if response.status_code < 400:
+                invalidate_tags(*format_tags(tags, args, kwargs))
+            return response
+        return _tag_invalidator
+    return _wrap
+
+
+def Coalesce(timeout=coalescing.COALESCE_TIMEOUT, include_user=True):
+    """
+    Runs the decorated GET method once for concurrent identical requests
+    in a worker (see sleepy.coalescing). Requests are identical when
+    they share the canonical request key CacheResponse uses, including
+    the requesting user. Only pass include_user=False for responses
+    that are the same for every user. Waiting requests get a copy of the
+    response, or compute their own after timeout seconds or once their
+    time budget runs out.
+    """
+    def _wrap(fn):
+        def _coalescer(*args, **kwargs):
+            request = find_request(args)
+
+            # Only reads can share a result and streamed responses
+            # can't be copied
+            if (request is None
+                    or request.method not in ('GET', 'HEAD')
+                    or wants_ndjson(request)):
+                return fn(*args, **kwargs)
+
+            key = "{0}.{1}:{2}".format(
+                fn.__module__,
+                fn.__name__,
+                request_cache_key(
+                    request,
+                    include_user,
+                    representation_key_suffix(request)
+                )
+            )
+
+            return coalescing.run(
+                key,
+                lambda: fn(*args, **kwargs),
+                deadlines.timeout_for(timeout, request)
+            )
+        return _coalescer
+    return _wrap
+
+
+def CircuitBreaker(
+    key=None,
+    failure_threshold=5,
+    window=60,
+    slow_call=None,
+    reset_timeout=30,
+    probe_interval=5):
+    """
+    Stops calling the decorated method while it keeps failing, see
+    sleepy.breaker for how the breaker opens and closes. A call fails
+    when it raises, returns a 5xx response or, with slow_call, takes
+    longer than slow_call seconds.
+
+    Each handler class and method gets a breaker of its own unless key
+    is given, key is formatted with the method's keyword arguments
+    ("geocoder:{region}") so that calls can share or split breakers.
+    Calls missing one of key's arguments share the handler's breaker.
+    While the breaker is open calls are answered with the response
+    CacheResponse last cached for them, when the decorated method is
+    also decorated with CacheResponse and a response is cached, and with
+    a 503 otherwise.
+    """
+    def _wrap(fn):
+        def _circuit_breaker(self, *args, **kwargs):
+            name = "{0}.{1}.{2}".format(
+                self.__class__.__module__,
+                self.__class__.__name__,
+                fn.__name__
+            )
+            if key is not None:
+                try:
+                    name = key.format(**kwargs)
+                except (KeyError, IndexError):
+                    pass
+
+            circuit = breaker.Breaker(
+                name,
+                failure_threshold,
+                window,
+                reset_timeout,
+                probe_interval
+            )
+
+            state = circuit.state()
+            if not circuit.allow(state):
+                cached_response = getattr(fn, 'cached_response', None)
+                if cached_response is not None:
+                    response = cached_response(self, *args, **kwargs)
+                    if response is not None:
+                        response['Warning'] = '110 - "Response is Stale"'
+                        return response
+
+                return api_error(
+                    "this resource is temporarily unavailable",
+                    "Unavailable Error",
+                    503,
+                    headers={'Retry-After': int(math.ceil(reset_timeout))}
+                )
+
+            started = time.time()
+            try:
+                response = fn(self, *args, **kwargs)
+            except Exception:
+                circuit.record_failure(state)
+                raise
+
+            if (response.status_code >= 500
+                    or (slow_call is not None
+                        and time.time() - started > slow_call)):
+                circuit.record_failure(state)
+            else:
+                circuit.record_success(state)
 
-            # Return the response
             return response
+        return _circuit_breaker
+    return _wrap
 
-        return _cacher
+
+def Deadline(seconds):
+    """
+    Gives the decorated method at most seconds of the request's time
+    budget (see sleepy.deadlines), the budget is never lengthened
+    """
+    def _wrap(fn):
+        def _deadline(*args, **kwargs):
+            request = find_request(args)
+            if request is None:
+                return fn(*args, **kwargs)
+
+            outer_deadline = getattr(request, 'deadline', None)
+            deadline = time.time() + seconds
+            if outer_deadline is None or deadline < outer_deadline:
+                request.deadline = deadline
+
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                request.deadline = outer_deadline
+        return _deadline
     return _wrap
 
 if __name__ == '__main__':
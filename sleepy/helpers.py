@@ -9,6 +9,14 @@ from django.http import HttpResponse
 from responses import api_out
 
 
+class _Removed(object):
+    def __repr__(self):
+        return 'REMOVED'
+
+# The value of keypaths apply_patch removes
+REMOVED = _Removed()
+
+
 def str2bool(str_):
     """
     Convert a string representation of a boolean value into
@@ -155,6 +163,299 @@ def find(needle, seq):
     return len(seq), None
 
 
+# Sentinel used by KeyPath to tell a missing key apart from a None value
+_MISSING = object()
+
+# Compiled keypaths keyed by their dotted string, see compile_keypath
+_COMPILED_KEYPATHS = {}
+_COMPILED_KEYPATHS_MAX = 1024
+
+
+class KeyPath(object):
+    """
+    A dotted keypath that is parsed once so that it can be applied to
+    many data structures without splitting the path on every call.
+    Numeric segments index into lists and a '*' segment fans out over
+    every element of a list (or every value of a dictionary).
+
+    >>> KeyPath('fruits.apple.color').get({'fruits': {'apple': {'color': 'red'}}})
+    'red'
+    >>> KeyPath('stories.1.id').get({'stories': [{'id': 5}, {'id': 6}]})
+    6
+    >>> KeyPath('stories.*.id').get({'stories': [{'id': 5}, {'id': 6}]})
+    [5, 6]
+    >>> KeyPath('stories.*.id').set({'stories': [{'id': 5}, {'id': 6}]}, 0)
+    {'stories': [{'id': 0}, {'id': 0}]}
+    >>> KeyPath('stories.2.id').set({'stories': [{'id': 5}]}, 7)
+
+    >>> KeyPath('author.name').set({}, 'Ann', create_if_needed=True)
+    {'author': {'name': 'Ann'}}
+    >>> KeyPath('title.text').get({'title': 'text'})
+
+    >>> KeyPath('fruit').extract([{'fruit': 'apple'}, {}, {'fruit': 'pear'}])
+    ['apple', None, 'pear']
+    """
+
+    __slots__ = ('keypath', 'segments', 'has_wildcard', 'keys')
+
+    WILDCARD = '*'
+
+    def __init__(self, keypath):
+        self.keypath = keypath
+        self.segments = tuple(
+            (key, KeyPath._index(key))
+            for key
+            in (keypath.split('.') if keypath else ()))
+        self.has_wildcard = any(
+            key == KeyPath.WILDCARD for key, _ in self.segments)
+
+        # Paths without wildcards or list indexes only walk dictionaries,
+        # the common case, which get, set, extract and assign handle with
+        # a plain loop over the keys. None for every other path.
+        self.keys = None
+        if not self.has_wildcard and all(
+                index is None for _, index in self.segments):
+            self.keys = tuple(key for key, _ in self.segments)
+
+    def __repr__(self):
+        return "KeyPath({0!r})".format(self.keypath)
+
+    @staticmethod
+    def _index(key):
+        try:
+            return int(key)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _child(value, key, index):
+        """
+        Returns the element of value named by a single segment or
+        _MISSING if value has no such element.
+        """
+        if isinstance(value, dict):
+            return value.get(key, _MISSING)
+
+        if index is not None and isinstance(value, (list, tuple)):
+            try:
+                return value[index]
+            except IndexError:
+                return _MISSING
+
+        return _MISSING
+
+    @staticmethod
+    def _elements(value):
+        if isinstance(value, dict):
+            return value.values()
+        if isinstance(value, (list, tuple)):
+            return value
+        return None
+
+    def get(self, obj):
+        """
+        Returns the value at this keypath in obj or None if the keypath
+        does not exist. Wildcard segments return a list with one entry
+        per element they matched.
+        """
+        keys = self.keys
+        if keys is not None:
+            value = obj
+            try:
+                for key in keys:
+                    if key in value:
+                        value = value[key]
+                    else:
+                        return None
+            except TypeError:
+                # value isn't a dictionary
+                return None
+            return value
+
+        if self.has_wildcard:
+            return self._get_fanout(obj, 0)
+
+        value = obj
+        child = KeyPath._child
+        for key, index in self.segments:
+            value = child(value, key, index)
+            if value is _MISSING:
+                return None
+
+        return value
+
+    def _get_fanout(self, value, position):
+        segments = self.segments
+        for ii in range(position, len(segments)):
+            key, index = segments[ii]
+            if key == KeyPath.WILDCARD:
+                elements = KeyPath._elements(value)
+                if elements is None:
+                    return None
+                return [
+                    self._get_fanout(element, ii + 1)
+                    for element
+                    in elements]
+
+            value = KeyPath._child(value, key, index)
+            if value is _MISSING:
+                return None
+
+        return value
+
+    def set(self, obj, value, create_if_needed=False):
+        """
+        Sets the value at this keypath in obj, modifying obj in place.
+        Returns obj if the value was set or None if the keypath does not
+        exist (and create_if_needed was not given).
+        """
+        if not self.segments:
+            return None
+
+        if self.keys is not None:
+            if KeyPath._set_keys(
+                    obj, self.keys[:-1], self.keys[-1], value,
+                    create_if_needed):
+                return obj
+            return None
+
+        if self._set(obj, 0, value, create_if_needed):
+            return obj
+
+        return None
+
+    @staticmethod
+    def _set_keys(container, parents, last, value, create_if_needed):
+        try:
+            for key in parents:
+                if key in container:
+                    container = container[key]
+                elif create_if_needed and isinstance(container, dict):
+                    child = container[key] = {}
+                    container = child
+                else:
+                    return False
+        except TypeError:
+            return False
+
+        if not isinstance(container, dict):
+            return False
+
+        if create_if_needed or last in container:
+            container[last] = value
+            return True
+
+        return False
+
+    def _set(self, container, position, value, create_if_needed):
+        segments = self.segments
+        last = len(segments) - 1
+
+        for ii in range(position, last):
+            key, index = segments[ii]
+            if key == KeyPath.WILDCARD:
+                elements = KeyPath._elements(container)
+                if elements is None:
+                    return False
+                updated = False
+                for element in elements:
+                    if self._set(element, ii + 1, value, create_if_needed):
+                        updated = True
+                return updated
+
+            if create_if_needed and isinstance(container, dict):
+                container.setdefault(key, {})
+
+            container = KeyPath._child(container, key, index)
+            if container is _MISSING:
+                return False
+
+        key, index = segments[last]
+        if isinstance(container, dict):
+            if key == KeyPath.WILDCARD:
+                for element_key in container:
+                    container[element_key] = value
+                return len(container) > 0
+            if create_if_needed or key in container:
+                container[key] = value
+                return True
+            return False
+
+        if isinstance(container, list):
+            if key == KeyPath.WILDCARD:
+                container[:] = [value] * len(container)
+                return len(container) > 0
+            if index is not None and -len(container) <= index < len(container):
+                container[index] = value
+                return True
+
+        return False
+
+    def extract(self, records):
+        """
+        Returns a list with the value at this keypath for each record
+        """
+        keys = self.keys
+        if keys is None:
+            get = self.get
+            return [get(record) for record in records]
+
+        values = []
+        append = values.append
+        for value in records:
+            try:
+                for key in keys:
+                    if key in value:
+                        value = value[key]
+                    else:
+                        value = None
+                        break
+            except TypeError:
+                value = None
+            append(value)
+
+        return values
+
+    def assign(self, records, values, create_if_needed=False):
+        """
+        Sets the value at this keypath on each record to the value at the
+        same position in values. Returns the number of records updated.
+        """
+        updated = 0
+
+        if self.keys:
+            set_keys = KeyPath._set_keys
+            parents = self.keys[:-1]
+            last = self.keys[-1]
+            for record, value in zip(records, values):
+                if set_keys(record, parents, last, value, create_if_needed):
+                    updated += 1
+            return updated
+
+        set_ = self.set
+        for record, value in zip(records, values):
+            if set_(record, value, create_if_needed) is not None:
+                updated += 1
+        return updated
+
+
+def compile_keypath(keypath):
+    """
+    Returns a KeyPath for a dotted keypath string, reusing a previously
+    compiled KeyPath when one exists.
+
+    >>> compile_keypath('fruits.apple') is compile_keypath('fruits.apple')
+    True
+    """
+    try:
+        return _COMPILED_KEYPATHS[keypath]
+    except KeyError:
+        if len(_COMPILED_KEYPATHS) >= _COMPILED_KEYPATHS_MAX:
+            _COMPILED_KEYPATHS.clear()
+        compiled = _COMPILED_KEYPATHS[keypath] = KeyPath(keypath)
+        return compiled
+
+
 def value_for_keypath(dict, keypath):
     """
     Returns the value of a keypath in a dictionary
@@ -188,18 +489,27 @@ def value_for_keypath(dict, keypath):
     >>> value_for_keypath({'fruits': {'apple': {'color': 'red', 'taste': 'good'}}}, 'fruits.apple.taste')
     'good'
     """
-    
-    if len(keypath) == 0:
+
+    if not keypath:
         return dict
-    
-    keys = keypath.split('.')
+
+    try:
+        keys = _COMPILED_KEYPATHS[keypath].keys
+    except KeyError:
+        keys = compile_keypath(keypath).keys
+
+    if keys is None:
+        return compile_keypath(keypath).get(dict)
+
     value = dict
-    for key in keys:
-        if key in value:
-            value = value[key]
-        else:
-            return None
-    
+    try:
+        for key in keys:
+            if key in value:
+                value = value[key]
+            else:
+                return None
+    except TypeError:
+        return None
     return value
 
 
@@ -241,33 +551,70 @@ def set_value_for_keypath(dict_, keypath, value, create_if_needed=False):
     {'fruit': {'apple': {'color': 'red', 'animals': {'puppies': {'count': 10, 'breed': 'boxers'}}}}}
     
     """
-    
-    if len(keypath) == 0:
-        return None
-    
-    keys = keypath.split('.')
-    if len(keys) > 1:
-        key = keys[0]
 
-        if create_if_needed:
-            dict_[key] = dict_.get(key, {})
+    return compile_keypath(keypath).set(
+        dict_, value, create_if_needed=create_if_needed)
 
-        if key in dict_:
-            if set_value_for_keypath(dict_[key], '.'.join(keys[1:]), value,
-                create_if_needed=create_if_needed):
-                return dict_
 
-        return None
-    
-    if create_if_needed:
-        dict_[keypath] = dict_.get(keypath, {})
+def values_for_keypath(records, keypath):
+    """
+    Returns the value of a keypath for every dictionary in a list of
+    records. Records that don't contain the keypath yield None.
+
+    >>> values_for_keypath([{'id': 1}, {'id': 2}, {}], 'id')
+    [1, 2, None]
+    >>> values_for_keypath([{'tags': [{'name': 'a'}, {'name': 'b'}]}], 'tags.*.name')
+    [['a', 'b']]
+    """
+    return compile_keypath(keypath).extract(records)
+
+
+def set_values_for_keypath(records, keypath, values, create_if_needed=False):
+    """
+    Sets the value of a keypath on every dictionary in a list of
+    records, pairing each record with the value at the same position
+    in values. Returns the number of records that were updated.
+
+    >>> records = [{'fruit': 'apple'}, {'fruit': 'pear'}]
+    >>> set_values_for_keypath(records, 'fruit', ['banana', 'kiwi'])
+    2
+    >>> records
+    [{'fruit': 'banana'}, {'fruit': 'kiwi'}]
+    """
+    return compile_keypath(keypath).assign(
+        records, values, create_if_needed=create_if_needed)
+
+
+def apply_patch(document, changes):
+    """
+    Applies the keypath changes of a PATCH request (see sleepy.patching)
+    to a document, modifying it in place. REMOVED removes a key. Returns
+    the document.
+
+    >>> apply_patch({'title': 'Old', 'author': {'name': 'Ann'}, 'draft': True},
+    ...             {'title': 'New', 'author.age': 40, 'draft': REMOVED})
+    {'author': {'age': 40, 'name': 'Ann'}, 'title': 'New'}
+    >>> apply_patch({'title': 'Old'}, {'title': None})
+    {'title': None}
+    """
+    # Parents are patched before their children
+    for keypath in sorted(changes):
+        value = changes[keypath]
+        if value is not REMOVED:
+            set_value_for_keypath(
+                document, keypath, value, create_if_needed=True)
+            continue
+
+        parent_keypath, _separator, key = keypath.rpartition('.')
+        parent = document
+        if parent_keypath:
+            parent = value_for_keypath(document, parent_keypath)
+
+        if isinstance(parent, dict):
+            parent.pop(key, None)
+
+    return document
 
-    if keypath in dict_:
-        dict_[keypath] = value
-        return dict_
-    else:
-        return None
-    
 
 if __name__ == "__main__":
     import doctest
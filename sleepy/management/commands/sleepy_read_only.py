@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sleepy import admission
+
+
+class Command(BaseCommand):
+    args = "[on|off]"
+    help = (
+        "Turns the runtime read only flag on or off for every worker "
+        "sharing the cache, without it prints the current state."
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1 or (args and args[0] not in ("on", "off")):
+            raise CommandError("usage: sleepy_read_only [on|off]")
+
+        if args:
+            admission.set_read_only(args[0] == "on")
+
+        self.stdout.write(
+            "read only mode is {0}".format(
+                "on" if admission.is_read_only() else "off"
+            )
+        )
@@ -0,0 +1,32 @@
+# Universe imports
+import time
+
+# Thirdparty imports
+from django.core.management.base import BaseCommand
+
+# Akimbo imports
+from sleepy.warmup import warm_up
+
+
+class Command(BaseCommand):
+    args = "[path ...]"
+    help = (
+        "Imports every handler in the URLconf, compiles the routes and "
+        "replays the given paths (or SLEEPY_WARM_UP_URLS) to prime "
+        "CacheResponse."
+    )
+
+    def handle(self, *paths, **options):
+        started = time.time()
+        summary = warm_up(list(paths) or None)
+
+        for path, status in summary['replayed']:
+            self.stdout.write("GET {0} {1}".format(path, status))
+
+        self.stdout.write(
+            "warmed {0} patterns and {1} handlers in {2:.2f}s".format(
+                summary['patterns'],
+                summary['handlers'],
+                time.time() - started
+            )
+        )
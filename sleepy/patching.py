@@ -0,0 +1,157 @@
+"""
+Sleepy Patching
+
+Parses the body of PATCH requests into the changes they make. Bodies
+are JSON Merge Patch documents (RFC 7386, sent as
+application/merge-patch+json or application/json) or JSON Patch
+operations (RFC 6902, sent as application/json-patch+json). Either way
+Base hands the handler a flat dictionary of the changed keypaths in
+request.PATCH, it isn't merged into the handler's keyword arguments:
+
+    {"title": "New title", "author": {"name": "Ann"}}
+
+becomes
+
+    {"title": "New title", "author.name": "Ann"}
+
+so handlers can update only the fields that changed. Fields that were
+removed, with a null in a merge patch or a remove operation, have the
+value REMOVED (defined in sleepy.helpers). None means the field was
+set to null. helpers.apply_patch applies the changes to a document.
+
+JSON Patch's add, replace and remove operations are supported on
+object members. move, copy, test and paths into arrays (numeric
+segments and "-") aren't, a merge patch replaces an array as a whole.
+"""
+
+# Universe imports
+import json
+
+# Akimbo imports
+from helpers import REMOVED
+
+MERGE_PATCH_CONTENT_TYPES = ('application/merge-patch+json', 'application/json')
+JSON_PATCH_CONTENT_TYPE = 'application/json-patch+json'
+
+
+class PatchError(ValueError):
+    """
+    Raised for PATCH bodies that can't be parsed, status_code is the
+    HTTP status to answer with
+    """
+
+    def __init__(self, message, status_code=400):
+        ValueError.__init__(self, message)
+        self.status_code = status_code
+
+
+def media_type(request):
+    """
+    Returns the media type of a request's body without its parameters
+    """
+    return request.META.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+
+
+def _check_key(key):
+    if '.' in key:
+        raise PatchError("{0}: keys containing '.' can't be patched".format(key))
+    return key
+
+
+def flatten_merge_patch(patch, prefix=""):
+    """
+    Returns the keypath changes a merge patch makes
+
+    >>> sorted(flatten_merge_patch({"a": 1, "b": {"c": None, "d": [1]}}).items())
+    [(u'a', 1), (u'b.c', REMOVED), (u'b.d', [1])]
+    """
+    changes = {}
+    for key, value in patch.items():
+        keypath = prefix + _check_key(unicode(key))
+        if isinstance(value, dict) and value:
+            changes.update(flatten_merge_patch(value, keypath + "."))
+        elif value is None:
+            changes[keypath] = REMOVED
+        else:
+            changes[keypath] = value
+    return changes
+
+
+def _pointer_to_keypath(pointer):
+    if not pointer.startswith('/'):
+        raise PatchError("{0} isn't a JSON pointer".format(pointer))
+
+    keys = []
+    for token in pointer[1:].split('/'):
+        token = token.replace('~1', '/').replace('~0', '~')
+        if token == '-' or token.isdigit():
+            raise PatchError(
+                "{0}: paths into arrays aren't supported".format(pointer)
+            )
+        keys.append(_check_key(token))
+
+    return ".".join(keys)
+
+
+def flatten_json_patch(operations):
+    """
+    Returns the keypath changes a list of JSON Patch operations makes
+
+    >>> flatten_json_patch([{"op": "replace", "path": "/a/b", "value": 2}])
+    {'a.b': 2}
+    >>> flatten_json_patch([{"op": "add", "path": "/a", "value": None},
+    ...                     {"op": "remove", "path": "/b"}])
+    {'a': None, 'b': REMOVED}
+    """
+    if not isinstance(operations, list):
+        raise PatchError("a JSON Patch body must be a list of operations")
+
+    changes = {}
+    for operation in operations:
+        if not isinstance(operation, dict) or 'path' not in operation:
+            raise PatchError("JSON Patch operations need an op and a path")
+
+        op = operation.get('op')
+        keypath = _pointer_to_keypath(operation['path'])
+
+        if op in ('add', 'replace'):
+            if 'value' not in operation:
+                raise PatchError("{0} operations need a value".format(op))
+            changes[keypath] = operation['value']
+        elif op == 'remove':
+            changes[keypath] = REMOVED
+        else:
+            raise PatchError("the {0} operation isn't supported".format(op))
+
+    return changes
+
+
+def parse_patch(request):
+    """
+    Returns the keypath changes a PATCH request makes, raises PatchError
+    for bodies it can't parse
+    """
+    content_type = media_type(request)
+
+    if (content_type not in MERGE_PATCH_CONTENT_TYPES
+            and content_type != JSON_PATCH_CONTENT_TYPE):
+        raise PatchError(
+            "PATCH bodies must be {0} or {1}".format(
+                MERGE_PATCH_CONTENT_TYPES[0],
+                JSON_PATCH_CONTENT_TYPE
+            ),
+            415
+        )
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        raise PatchError("the PATCH body isn't valid JSON")
+
+    if content_type == JSON_PATCH_CONTENT_TYPE:
+        return flatten_json_patch(body)
+
+    if not isinstance(body, dict):
+        raise PatchError("a merge patch must be a JSON object")
+
+    return flatten_merge_patch(body)
@@ -0,0 +1,170 @@
+"""
+Sleepy Profiling
+
+Profiles single requests in production without a redeploy. A request
+is profiled when it carries a signed token (see profile_token) in the
+X-Sleepy-Profile header or the _profile parameter, or when it's picked
+by random sampling. A global, per minute rate limit bounds how many
+requests are profiled across all workers. Each profile is written to
+SLEEPY_PROFILE_DIR as a pstats file named after the handler, the
+method and the time. With SLEEPY_PROFILE_MEMORY a tracemalloc snapshot
+is written next to it on interpreters that support tracemalloc.
+
+Profiling is off unless SLEEPY_PROFILE_DIR is set. Requests that aren't
+profiled only pay for a single check.
+"""
+
+# Universe imports
+import os
+import time
+import errno
+import random
+import logging
+import cProfile
+from datetime import datetime
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Thirdparty imports
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+PROFILE_DIR = getattr(settings, 'SLEEPY_PROFILE_DIR', None)
+
+# The fraction of requests profiled without a token
+PROFILE_SAMPLE_RATE = getattr(settings, 'SLEEPY_PROFILE_SAMPLE_RATE', 0.0)
+
+# The most requests profiled per minute across all workers
+PROFILE_RATE_LIMIT = getattr(settings, 'SLEEPY_PROFILE_RATE_LIMIT', 6)
+
+# Seconds a profile token stays valid for
+PROFILE_TOKEN_MAX_AGE = getattr(settings, 'SLEEPY_PROFILE_TOKEN_MAX_AGE', 3600)
+
+PROFILE_MEMORY = getattr(settings, 'SLEEPY_PROFILE_MEMORY', False)
+
+PROFILE_HEADER = 'HTTP_X_SLEEPY_PROFILE'
+PROFILE_PARAM = '_profile'
+PROFILE_SALT = 'sleepy.profiling'
+
+PROFILING_ENABLED = PROFILE_DIR is not None
+
+logger = logging.getLogger('sleepy.profiling')
+
+
+def profile_token(path):
+    """
+    Returns a token that triggers a profile for requests to path for the
+    next PROFILE_TOKEN_MAX_AGE seconds. Tokens are signed with the
+    project's SECRET_KEY.
+    """
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(path)
+
+
+def _valid_token(token, path):
+    try:
+        signed_path = signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+            token,
+            max_age=PROFILE_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+
+    return signed_path == path
+
+
+def _within_rate_limit():
+    """
+    Counts a profile against the global per minute limit, returns False
+    once the limit has been reached
+    """
+    key = "sleepy:profiles:{0}".format(int(time.time() // 60))
+    cache.add(key, 0, 60)
+    try:
+        return cache.incr(key) <= PROFILE_RATE_LIMIT
+    except ValueError:
+        return False
+
+
+def should_profile(request):
+    """
+    Returns True if this request should be profiled
+    """
+    token = (request.META.get(PROFILE_HEADER)
+             or request.GET.get(PROFILE_PARAM))
+
+    if token:
+        triggered = _valid_token(token, request.path)
+    else:
+        triggered = (PROFILE_SAMPLE_RATE > 0
+                     and random.random() < PROFILE_SAMPLE_RATE)
+
+    return triggered and _within_rate_limit()
+
+
+def _profile_path(label):
+    try:
+        os.makedirs(PROFILE_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    return os.path.join(
+        PROFILE_DIR,
+        "{0}.{1}.{2}".format(
+            label,
+            datetime.now().strftime("%Y%m%dT%H%M%S.%f"),
+            os.getpid()
+        )
+    )
+
+
+def profile_call(label, func, *args, **kwargs):
+    """
+    Runs func under cProfile and writes the profile to
+    PROFILE_DIR/<label>.<timestamp>.<pid>.pstats. Returns whatever func
+    returns, with the name of the profile in an X-Sleepy-Profile header
+    when it's a response.
+    """
+    trace_memory = (PROFILE_MEMORY
+                    and tracemalloc is not None
+                    and not tracemalloc.is_tracing())
+    if trace_memory:
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        path = _save_profile(label, profiler, trace_memory)
+
+    if path is not None and hasattr(result, 'has_header'):
+        result['X-Sleepy-Profile'] = os.path.basename(path)
+
+    return result
+
+
+def _save_profile(label, profiler, trace_memory):
+    """
+    Writes a profile and returns its path, or None when it couldn't be
+    written. Errors are logged rather than raised so that they never
+    replace the profiled call's response or exception.
+    """
+    path = None
+    try:
+        path = _profile_path(label)
+        profiler.dump_stats(path + ".pstats")
+
+        if trace_memory:
+            tracemalloc.take_snapshot().dump(path + ".tracemalloc")
+    except (IOError, OSError):
+        logger.exception("the profile of %s couldn't be written", label)
+        path = None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return path
@@ -0,0 +1,285 @@
+"""
+Sleepy Renderers
+
+A registry of the representations api_out and api_error can encode a
+response in. The representation is picked per request from a format
+parameter or the Accept header and defaults to JSON. Besides JSON a
+compact MessagePack renderer is registered for service to service
+calls. It uses the msgpack package when it's installed and a pure
+Python encoder otherwise, both write the same bytes: strings, byte
+strings included, are sent with the raw/str family of types (the
+original MessagePack spec, use_bin_type=False) and never as bin.
+"""
+
+# Universe imports
+import json
+import struct
+import functools
+from collections import OrderedDict
+
+# Akimbo imports
+from context import current_request
+
+
+class RawJSON(str):
+    """
+    A string of already encoded JSON. When it's passed to api_out as
+    data it is written into the response as is instead of being encoded
+    again.
+    """
+
+
+class Renderer(object):
+    """
+    Encodes a response dictionary into one representation. encode is
+    called with the response dictionary and the indent requested by the
+    handler (which renderers are free to ignore).
+    """
+
+    def __init__(self, name, content_type, encode):
+        self.name = name
+        self.content_type = content_type
+        self.encode = encode
+
+    def __repr__(self):
+        return "Renderer({0!r}, {1!r})".format(self.name, self.content_type)
+
+
+def _decode_raw_json(response):
+    """
+    Decodes RawJSON data for renderers that can't splice JSON in
+    """
+    if isinstance(response.get('data'), RawJSON):
+        response = dict(response)
+        response['data'] = json.loads(response['data'])
+    return response
+
+
+def encode_json(response, indent=None):
+    """
+    Encodes a response dictionary as JSON, splicing in its data
+    untouched when it's RawJSON
+    """
+    data = response.get('data')
+    if not isinstance(data, RawJSON):
+        return json.dumps(response, indent=indent)
+
+    rest = dict(response)
+    del rest['data']
+    if not rest:
+        return '{"data": ' + data + '}'
+
+    # Drop the opening brace of the encoded remainder and continue the
+    # object after data
+    return '{"data": ' + data + ', ' + json.dumps(rest, indent=indent)[1:]
+
+
+def _pack(obj, out):
+    """
+    A pure Python MessagePack encoder for the types that JSON supports,
+    writing what msgpack.packb(obj, use_bin_type=False) writes
+    """
+    if obj is None:
+        out.append('\xc0')
+
+    elif obj is True:
+        out.append('\xc3')
+
+    elif obj is False:
+        out.append('\xc2')
+
+    elif isinstance(obj, (int, long)):
+        if 0 <= obj < 0x80:
+            out.append(struct.pack('B', obj))
+        elif -0x20 <= obj < 0:
+            out.append(struct.pack('b', obj))
+        elif 0 <= obj <= 0xff:
+            out.append(struct.pack('>BB', 0xcc, obj))
+        elif 0 <= obj <= 0xffff:
+            out.append(struct.pack('>BH', 0xcd, obj))
+        elif 0 <= obj <= 0xffffffff:
+            out.append(struct.pack('>BI', 0xce, obj))
+        elif 0 <= obj <= 0xffffffffffffffff:
+            out.append(struct.pack('>BQ', 0xcf, obj))
+        elif -0x80 <= obj < 0:
+            out.append(struct.pack('>Bb', 0xd0, obj))
+        elif -0x8000 <= obj < 0:
+            out.append(struct.pack('>Bh', 0xd1, obj))
+        elif -0x80000000 <= obj < 0:
+            out.append(struct.pack('>Bi', 0xd2, obj))
+        elif -0x8000000000000000 <= obj < 0:
+            out.append(struct.pack('>Bq', 0xd3, obj))
+        else:
+            raise OverflowError("{0} is too large for MessagePack".format(obj))
+
+    elif isinstance(obj, float):
+        out.append(struct.pack('>Bd', 0xcb, obj))
+
+    elif isinstance(obj, basestring):
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+        length = len(obj)
+        # str 8 isn't part of the original spec
+        if length < 0x20:
+            out.append(struct.pack('B', 0xa0 | length))
+        elif length <= 0xffff:
+            out.append(struct.pack('>BH', 0xda, length))
+        else:
+            out.append(struct.pack('>BI', 0xdb, length))
+        out.append(obj)
+
+    elif isinstance(obj, (list, tuple)):
+        length = len(obj)
+        if length < 0x10:
+            out.append(struct.pack('B', 0x90 | length))
+        elif length <= 0xffff:
+            out.append(struct.pack('>BH', 0xdc, length))
+        else:
+            out.append(struct.pack('>BI', 0xdd, length))
+        for item in obj:
+            _pack(item, out)
+
+    elif isinstance(obj, dict):
+        length = len(obj)
+        if length < 0x10:
+            out.append(struct.pack('B', 0x80 | length))
+        elif length <= 0xffff:
+            out.append(struct.pack('>BH', 0xde, length))
+        else:
+            out.append(struct.pack('>BI', 0xdf, length))
+        for key, value in obj.iteritems():
+            _pack(key, out)
+            _pack(value, out)
+
+    else:
+        raise TypeError("{0!r} is not MessagePack serializable".format(obj))
+
+
+def packb(obj):
+    """
+    Encodes obj as MessagePack with the pure Python encoder
+
+    >>> packb({'data': [1, -1, 1.5, None, True]})
+    '\\x81\\xa4data\\x95\\x01\\xff\\xcb?\\xf8\\x00\\x00\\x00\\x00\\x00\\x00\\xc0\\xc3'
+    """
+    out = []
+    _pack(obj, out)
+    return ''.join(out)
+
+
+try:
+    # msgpack uses its C extension when it was built and falls back to
+    # its own pure Python implementation otherwise
+    import msgpack
+    _packb = functools.partial(msgpack.packb, use_bin_type=False)
+except ImportError:
+    _packb = packb
+
+
+def encode_msgpack(response, indent=None):
+    return _packb(_decode_raw_json(response))
+
+
+JSON_RENDERER = Renderer('json', 'application/json', encode_json)
+
+MSGPACK_RENDERER = Renderer('msgpack', 'application/x-msgpack', encode_msgpack)
+
+_renderers = OrderedDict()
+_default_renderer = [JSON_RENDERER]
+
+# Parsed Accept headers, clients send a handful of distinct ones
+_accept_cache = {}
+_ACCEPT_CACHE_MAX = 256
+
+
+def register_renderer(renderer, default=False):
+    """
+    Makes a renderer available to content negotiation, replacing any
+    renderer registered under the same content type
+    """
+    _renderers[renderer.content_type] = renderer
+    if default:
+        _default_renderer[0] = renderer
+    _accept_cache.clear()
+
+
+def registered_renderers():
+    return _renderers.values()
+
+
+def _parse_accept(accept):
+    """
+    Returns the media types of an Accept header ordered by preference
+
+    >>> _parse_accept('application/json;q=0.5, application/x-msgpack')
+    ['application/x-msgpack', 'application/json']
+    """
+    media_ranges = []
+    for position, media_range in enumerate(accept.split(',')):
+        parts = media_range.split(';')
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _separator, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            media_ranges.append((-quality, position, parts[0].strip()))
+
+    media_ranges.sort()
+    return [media_type for _quality, _position, media_type in media_ranges]
+
+
+def _negotiate(accept):
+    for media_type in _parse_accept(accept):
+        if media_type in _renderers:
+            return _renderers[media_type]
+
+        if media_type == '*/*':
+            return _default_renderer[0]
+
+        if media_type.endswith('/*'):
+            prefix = media_type[:-1]
+            if _default_renderer[0].content_type.startswith(prefix):
+                return _default_renderer[0]
+            for content_type, renderer in _renderers.items():
+                if content_type.startswith(prefix):
+                    return renderer
+
+    return _default_renderer[0]
+
+
+def renderer_for_request(request=None):
+    """
+    Returns the renderer for a request (by default the request currently
+    being served). A format parameter naming a renderer wins over the
+    Accept header, anything unknown gets the default renderer.
+    """
+    if request is None:
+        request = current_request()
+        if request is None:
+            return _default_renderer[0]
+
+    format_ = request.REQUEST.get("format")
+    if format_ is not None:
+        for renderer in _renderers.itervalues():
+            if renderer.name == format_:
+                return renderer
+
+    accept = request.META.get('HTTP_ACCEPT')
+    if not accept:
+        return _default_renderer[0]
+
+    try:
+        return _accept_cache[accept]
+    except KeyError:
+        if len(_accept_cache) >= _ACCEPT_CACHE_MAX:
+            _accept_cache.clear()
+        renderer = _accept_cache[accept] = _negotiate(accept)
+        return renderer
+
+
+register_renderer(JSON_RENDERER)
+register_renderer(MSGPACK_RENDERER)
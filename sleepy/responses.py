@@ -1,7 +1,88 @@
+from django.conf import settings
 from django.utils.encoding import iri_to_uri
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import json
 
+from caching import FRAGMENT_CACHE_TIMEOUT, row_fragments, rows_by_id
+from context import current_request
+from renderers import RawJSON, renderer_for_request
+from serialization import serialize_rows
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# The most ids one multi-get request may ask for, see the AcceptsIds
+# decorator
+MULTIGET_MAX_IDS = getattr(settings, 'SLEEPY_MULTIGET_MAX_IDS', 100)
+
+# How table_out lays out rows unless the request's layout parameter
+# says otherwise, 'objects' or 'columns'
+TABLE_LAYOUT = getattr(settings, 'SLEEPY_TABLE_LAYOUT', 'objects')
+TABLE_LAYOUT_PARAM = 'layout'
+
+
+def wants_ndjson(request=None):
+    """
+    Returns True if the request (by default the request currently being
+    served) asked for newline delimited JSON, either with an Accept
+    header or a format=ndjson parameter
+    """
+    if request is None:
+        request = current_request()
+        if request is None:
+            return False
+
+    if request.REQUEST.get("format") == "ndjson":
+        return True
+
+    return NDJSON_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+
+def _ndjson_lines(records, meta_data):
+    if meta_data:
+        yield json.dumps({'meta': meta_data}) + "\n"
+
+    for record in records:
+        if isinstance(record, RawJSON):
+            yield record + "\n"
+        else:
+            yield json.dumps(record) + "\n"
+
+
+def ndjson_out(records, meta_data=None, status_code=200, headers=None):
+    """
+    ndjson_out takes an iterable of records and returns a streaming
+    django response with one JSON encoded record per line. Records are
+    encoded and sent one at a time as the response is consumed, so a
+    generator of records is never held in memory as a whole.
+
+    :Parameters:
+      records : iterable
+        The records to output, typically a list or a generator of
+        dictionaries. RawJSON records are written as they are.
+      meta_data : dictionary
+        If given it is sent first as a line of its own under the 'meta'
+        key
+      status_code : integer
+        The HTTP response code to pass back for the response
+      headers : dictionary
+        A dictionary representing the response headers we would
+        like to send back for this request
+    """
+    if None == headers:
+        headers = {}
+
+    api_response = StreamingHttpResponse(
+        _ndjson_lines(records, meta_data),
+        content_type=NDJSON_CONTENT_TYPE
+    )
+
+    api_response.status_code = status_code
+
+    for k, v in headers.items():
+        api_response[k] = v
+
+    return api_response
+
 
 def api_out(
     data,
@@ -9,7 +90,8 @@ def api_out(
     cgi_escape=True,
     indent=None,
     status_code=200,
-    headers=None):
+    headers=None,
+    stream=False):
     """
     json_out takes a python datastructure (list, dict,
     OrderedDict, etc) as an argument and returns a django response
@@ -30,9 +112,17 @@ def api_out(
       headers : dictionary
         A dictionary representing the response headers we would
         like to send back for this request
+      stream : boolean
+        Whether data is an iterable of records that may be streamed
+        one per line to clients that asked for newline delimited JSON
+        (see wants_ndjson)
     """
 
-    api_response = HttpResponse(mimetype='application/json')
+    if stream and wants_ndjson():
+        return ndjson_out(data, meta_data, status_code, headers)
+
+    renderer = renderer_for_request()
+    api_response = HttpResponse(content_type=renderer.content_type)
 
     if None == meta_data:
         meta_data = {}
@@ -43,7 +133,7 @@ def api_out(
     response = {'data': data}
     response.update(meta_data)
 
-    api_response.write(json.dumps(response, indent=indent))
+    api_response.write(renderer.encode(response, indent))
 
     api_response.status_code = status_code
 
@@ -59,8 +149,117 @@ def queryset_out(queryset, *args, **kwargs):
     calls the .as_dict method (the method that sleepy assumes will be
     used to explain how to deserialize this model on each item in the
     queryset
+
+    Models that declare sleepy_fields are read with values_list()
+    instead, without building a model instance per row, see
+    sleepy.serialization.
+
+    Passing fragment_cache the name of a version field (such as
+    updated_at) caches the JSON of each row under its model, pk and
+    version and stitches the cached JSON into the response without
+    decoding it. fragment_duration sets how long rows stay cached.
+
+    Clients asking for newline delimited JSON (see wants_ndjson) get
+    the rows streamed one per line as they are read from the database.
     """
-    return api_out([item.as_dict for item in queryset.all()], *args, **kwargs)
+    version_field = kwargs.pop('fragment_cache', None)
+    duration = kwargs.pop('fragment_duration', FRAGMENT_CACHE_TIMEOUT)
+    kwargs.setdefault('stream', True)
+
+    if version_field is not None:
+        fragments = row_fragments(queryset, version_field, duration)
+        if wants_ndjson():
+            data = (RawJSON(fragment) for fragment in fragments)
+        else:
+            data = RawJSON("[" + ", ".join(fragments) + "]")
+
+    elif wants_ndjson():
+        # Iterate without filling the queryset's result cache so that
+        # memory stays flat however many rows are streamed
+        data = (row for _pk, row in serialize_rows(queryset, streaming=True))
+
+    else:
+        data = [row for _pk, row in serialize_rows(queryset)]
+
+    return api_out(data, *args, **kwargs)
+
+
+def multiget_out(queryset, ids, meta_data=None, duration=None, tag=None, **kwargs):
+    """
+    Outputs the rows of queryset with the given ids (usually parsed by
+    the AcceptsIds decorator) in the order they were asked for. Ids that
+    weren't found are output as null and listed under 'not_found' in
+    the meta data. The rows are read with a single pk__in query and,
+    with duration, cached per id (see sleepy.caching.rows_by_id).
+    """
+    rows = rows_by_id(queryset, ids, duration, tag)
+
+    meta_data = dict(meta_data or {})
+    meta_data['not_found'] = [
+        pk for pk, row in zip(ids, rows) if row is None]
+
+    return api_out(rows, meta_data, **kwargs)
+
+
+def table_out(columns, rows, meta_data=None, layout=None, **kwargs):
+    """
+    Outputs tabular data that a handler holds as column names and row
+    tuples (or lists), without building a dictionary per row.
+
+    In the 'columns' layout the data is sent as is, so keys aren't
+    repeated for every row:
+
+        {"data": {"columns": ["id", "name"], "rows": [[1, "a"], [2, "b"]]}}
+
+    In the 'objects' layout each row is sent as an object, the same
+    output a list of dictionaries gives. Objects are built and encoded
+    one row at a time, so rows can be a generator. With newline
+    delimited JSON they're streamed as they're encoded, otherwise the
+    encoded rows are joined into the response body.
+
+    layout defaults to the request's layout parameter and then to
+    SLEEPY_TABLE_LAYOUT.
+    """
+    columns = list(columns)
+
+    if layout is None:
+        request = current_request()
+        if request is not None:
+            layout = request.REQUEST.get(TABLE_LAYOUT_PARAM)
+        if layout not in ('objects', 'columns'):
+            layout = TABLE_LAYOUT
+
+    if layout == 'columns':
+        if wants_ndjson():
+            meta_data = dict(meta_data or {})
+            meta_data['columns'] = columns
+            return api_out(
+                (list(row) for row in rows),
+                meta_data,
+                stream=True,
+                **kwargs
+            )
+
+        return api_out(
+            {'columns': columns, 'rows': [list(row) for row in rows]},
+            meta_data,
+            **kwargs
+        )
+
+    objects = (dict(zip(columns, row)) for row in rows)
+
+    if wants_ndjson():
+        return api_out(objects, meta_data, stream=True, **kwargs)
+
+    if renderer_for_request().name != 'json':
+        return api_out(list(objects), meta_data, **kwargs)
+
+    # Each row's dictionary is dropped once it's encoded, the encoded
+    # rows (and the body) are still held in memory as a whole. They're
+    # spliced into the envelope as is, see sleepy.renderers.RawJSON
+    encode = json.JSONEncoder().encode
+    data = RawJSON("[" + ", ".join(encode(obj) for obj in objects) + "]")
+    return api_out(data, meta_data, **kwargs)
 
 
 def blob_out(data, content_type, headers=None):
@@ -179,7 +378,8 @@ def api_error(
       type and the value will be the value of the header.
     """
 
-    api_response = HttpResponse(mimetype='application/json')
+    renderer = renderer_for_request()
+    api_response = HttpResponse(content_type=renderer.content_type)
 
     # Set meta_data to an empty dictionary if it's None
     if None == meta_data:
@@ -195,8 +395,9 @@ def api_error(
     if len(meta_data) > 0:
         response.update(meta_data)
 
-    # Dump out a JSON representation of the responsde
-    return_string = json.dumps(response)
+    # Dump out a representation of the response in the format the
+    # client asked for
+    return_string = renderer.encode(response)
 
     # Set the value of the response
     api_response.write(return_string)
@@ -0,0 +1,350 @@
+"""
+Sleepy Router
+
+Routes requests to Base handlers registered with path templates
+instead of regular expressions:
+
+    router = Router()
+    router.register('/stories', StoryListHandler())
+    router.register('/stories/{id:int}', StoryHandler(), name='story')
+    router.register('/files/{path:path}', FileHandler())
+
+    urlpatterns = patterns(
+        '',
+        url(r'^api/', include(router.urls)),
+        ...
+    )
+
+Templates are compiled into a trie keyed by path segment, so resolving
+a path costs one dictionary lookup per segment (plus the typed
+captures tried at each level) however many routes are registered.
+Django tries regex patterns one after the other. Captures are
+converted by type (str, int, slug or path for the rest of the path) and
+passed to the handler as keyword arguments. Paths the router doesn't
+know fall through to the patterns after it.
+
+router.urls also holds a pattern per named route built from its
+template. Those patterns never match a request, they put the routes in
+Django's reverse lookup tables under the prefix the router is included
+with, so reverse() and the url template tag find them:
+
+    reverse('story', kwargs={'id': 5})  # '/api/stories/5'
+"""
+
+# Universe imports
+import re
+
+# Thirdparty imports
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import RegexURLPattern, ResolverMatch
+
+_SLUG_RE = re.compile(r'^[-a-zA-Z0-9_]+$')
+
+
+def _convert_str(segment):
+    return segment
+
+
+def _convert_int(segment):
+    if not segment.isdigit():
+        raise ValueError(segment)
+    return int(segment)
+
+
+def _convert_slug(segment):
+    if _SLUG_RE.match(segment) is None:
+        raise ValueError(segment)
+    return segment
+
+
+# Converters for typed captures: name -> (specificity, convert, regex).
+# At each level captures are tried from the most specific converter to
+# the least specific one. convert raises ValueError for segments it
+# doesn't accept and regex matches the segments it accepts, for reverse().
+CONVERTERS = {
+    'int': (0, _convert_int, r'\d+'),
+    'slug': (1, _convert_slug, r'[-a-zA-Z0-9_]+'),
+    'str': (2, _convert_str, r'[^/]+'),
+}
+
+# The regex of {name:path} captures
+PATH_REGEX = r'.+'
+
+
+def register_converter(name, convert, specificity=1, regex=r'[^/]+'):
+    CONVERTERS[name] = (specificity, convert, regex)
+
+
+class Route(object):
+    """
+    A handler registered for a path template
+    """
+
+    def __init__(self, template, handler, name=None):
+        self.template = template
+        self.handler = handler
+        self.name = name
+
+    def __repr__(self):
+        return "Route({0!r})".format(self.template)
+
+
+class _Node(object):
+    __slots__ = ('literals', 'captures', 'rest', 'route')
+
+    def __init__(self):
+        # segment -> _Node
+        self.literals = {}
+        # [(specificity, converter name, capture name, convert, _Node)]
+        self.captures = []
+        # (capture name, Route) for a trailing {name:path} capture
+        self.rest = None
+        self.route = None
+
+
+def _split(path):
+    path = path.strip('/')
+    if not path:
+        return []
+    return path.split('/')
+
+
+def _parse_capture(segment):
+    """
+    Returns (name, converter) for a "{name:converter}" segment or None for
+    a literal segment
+    """
+    if not (segment.startswith('{') and segment.endswith('}')):
+        return None
+
+    name, _separator, converter = segment[1:-1].partition(':')
+    return name, converter or 'str'
+
+
+class Router(object):
+    """
+    Maps path templates to handlers, see the module documentation
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.routes = []
+        # name -> Route
+        self.names = {}
+
+    def _add(self, route):
+        if route.name is not None:
+            if route.name in self.names:
+                raise ImproperlyConfigured(
+                    "{0}: the name {1} is already used by {2}".format(
+                        route.template,
+                        route.name,
+                        self.names[route.name].template
+                    )
+                )
+            self.names[route.name] = route
+        self.routes.append(route)
+
+    def register(self, template, handler, name=None):
+        """
+        Routes requests whose path matches template to handler.
+        Segments written as {name} or {name:converter} capture a value
+        that is passed to the handler as a keyword argument.
+        """
+        route = Route(template, handler, name)
+        node = self.root
+        segments = _split(template)
+
+        for position, segment in enumerate(segments):
+            capture = _parse_capture(segment)
+
+            if capture is None:
+                node = node.literals.setdefault(segment, _Node())
+                continue
+
+            capture_name, converter = capture
+
+            if converter == 'path':
+                if position != len(segments) - 1:
+                    raise ImproperlyConfigured(
+                        "{0}: a path capture must be the last segment".format(
+                            template
+                        )
+                    )
+                if node.rest is not None:
+                    raise ImproperlyConfigured(
+                        "{0} conflicts with {1}".format(
+                            template,
+                            node.rest[1].template
+                        )
+                    )
+                self._add(route)
+                node.rest = (capture_name, route)
+                return route
+
+            if converter not in CONVERTERS:
+                raise ImproperlyConfigured(
+                    "{0}: unknown converter {1}".format(template, converter)
+                )
+
+            for existing in node.captures:
+                if existing[1] == converter and existing[2] == capture_name:
+                    node = existing[4]
+                    break
+            else:
+                specificity, convert, _regex = CONVERTERS[converter]
+                child = _Node()
+                node.captures.append(
+                    (specificity, converter, capture_name, convert, child)
+                )
+                node.captures.sort(key=lambda capture: capture[0])
+                node = child
+
+        if node.route is not None:
+            raise ImproperlyConfigured(
+                "{0} conflicts with {1}".format(template, node.route.template)
+            )
+
+        self._add(route)
+        node.route = route
+        return route
+
+    def route(self, template, name=None):
+        """
+        A class decorator that registers an instance of a handler class
+
+        @router.route('/stories/{id:int}')
+        class StoryHandler(Base):
+            ...
+        """
+        def _register(handler_class):
+            self.register(template, handler_class(), name)
+            return handler_class
+        return _register
+
+    def _match(self, node, segments, position, kwargs):
+        if position == len(segments):
+            if node.route is not None:
+                return node.route
+            return None
+
+        segment = segments[position]
+
+        child = node.literals.get(segment)
+        if child is not None:
+            route = self._match(child, segments, position + 1, kwargs)
+            if route is not None:
+                return route
+
+        for _specificity, _converter, name, convert, child in node.captures:
+            try:
+                value = convert(segment)
+            except ValueError:
+                continue
+
+            route = self._match(child, segments, position + 1, kwargs)
+            if route is not None:
+                kwargs[name] = value
+                return route
+
+        if node.rest is not None:
+            name, route = node.rest
+            kwargs[name] = "/".join(segments[position:])
+            return route
+
+        return None
+
+    def resolve(self, path):
+        """
+        Returns (route, kwargs) for path or None if no route matches
+        """
+        kwargs = {}
+        route = self._match(self.root, _split(path), 0, kwargs)
+        if route is None:
+            return None
+        return route, kwargs
+
+    def warm_up(self):
+        for route in self.routes:
+            warm_up = getattr(route.handler, 'warm_up', None)
+            if warm_up is not None:
+                warm_up()
+
+    @property
+    def urls(self):
+        """
+        URL patterns that mount the router in a Django URLconf, either
+        through include() or by adding them to urlpatterns
+        """
+        return [RouterURLPattern(self)] + [
+            RouteReversePattern(route)
+            for route
+            in self.routes
+            if route.name is not None]
+
+
+class RouterURLPattern(RegexURLPattern):
+    """
+    A Django URL pattern that resolves paths through a Router
+    """
+
+    def __init__(self, router):
+        RegexURLPattern.__init__(self, r'^', None)
+        # The router isn't a view, keep Django from importing it as one
+        del self._callback_str
+        self._callback = router
+        self.router = router
+
+    def resolve(self, path):
+        resolved = self.router.resolve(path)
+        if resolved is None:
+            # Returning None lets Django try the patterns after this one
+            return None
+
+        route, kwargs = resolved
+        return ResolverMatch(route.handler, (), kwargs, route.name)
+
+
+def template_regex(template):
+    """
+    Returns a regex matching the paths of a template, with a named group
+    per capture
+
+    >>> template_regex('/stories/{id:int}')
+    '^stories/(?P<id>\\\\d+)$'
+    """
+    parts = []
+    for segment in _split(template):
+        capture = _parse_capture(segment)
+        if capture is None:
+            parts.append(re.escape(segment))
+            continue
+
+        name, converter = capture
+        if converter == 'path':
+            regex = PATH_REGEX
+        else:
+            regex = CONVERTERS[converter][2]
+        parts.append("(?P<{0}>{1})".format(name, regex))
+
+    return "^" + "/".join(parts) + "$"
+
+
+class RouteReversePattern(RegexURLPattern):
+    """
+    A Django URL pattern that only puts a named route in the reverse
+    lookup tables, the RouterURLPattern before it resolves the route
+    """
+
+    def __init__(self, route):
+        RegexURLPattern.__init__(
+            self,
+            template_regex(route.template),
+            None,
+            name=route.name
+        )
+        del self._callback_str
+        self._callback = route.handler
+
+    def resolve(self, path):
+        return None
@@ -0,0 +1,193 @@
+"""
+Sleepy Serialization
+
+Turns querysets into the dictionaries queryset_out sends. Models
+serialize themselves through an as_dict property by default. A model
+can instead declare the fields it serializes, which lets sleepy read
+rows with values_list() without building a model instance per row:
+
+    class Story(models.Model):
+        sleepy_fields = (
+            'id',
+            'title',
+            # lookups through foreign keys become nested keypaths,
+            # this one is sent as {"author": {"name": ...}}
+            'author__name',
+            # (keypath, lookup) and (keypath, lookup, transform)
+            # rename or convert a value
+            ('updated', 'updated_at', lambda value: value.isoformat()),
+        )
+
+        # to-many relations are fetched with one extra query per
+        # relation and sent as lists of dictionaries
+        sleepy_relations = {'tags': ('id', 'name')}
+
+Models that keep using as_dict can declare sleepy_select_related and
+sleepy_prefetch_related so that related lookups inside as_dict don't
+issue a query per row.
+"""
+
+# Universe imports
+from itertools import islice
+
+# Thirdparty imports
+from django.db.models.query import prefetch_related_objects
+
+# Rows are read in batches of this size whenever related rows have to be
+# fetched for them, it also bounds the size of pk__in queries
+SERIALIZATION_BATCH_SIZE = 500
+
+# Parsed sleepy_fields keyed by model
+_field_specs = {}
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def declares_fields(model):
+    """
+    Returns True if model declares sleepy_fields and can be serialized
+    without instantiating it
+    """
+    return getattr(model, 'sleepy_fields', None) is not None
+
+
+def field_specs(model):
+    """
+    Returns a list of (lookup, keypath, transform) for each of a model's
+    sleepy_fields. keypath is a compiled KeyPath for nested output keys
+    and a plain string otherwise.
+    """
+    try:
+        return _field_specs[model]
+    except KeyError:
+        pass
+
+    # Imported here because helpers imports responses, which imports
+    # this module
+    from helpers import compile_keypath
+
+    specs = []
+    for field in model.sleepy_fields:
+        if isinstance(field, basestring):
+            field = (field.replace('__', '.'), field)
+
+        keypath, lookup = field[:2]
+        transform = field[2] if len(field) > 2 else None
+
+        if '.' in keypath:
+            keypath = compile_keypath(keypath)
+
+        specs.append((lookup, keypath, transform))
+
+    _field_specs[model] = specs
+    return specs
+
+
+def _related_rows(model, pks):
+    """
+    Returns {relation: {pk: [related dictionaries]}} for each of the
+    model's sleepy_relations, with one query per relation
+    """
+    related = {}
+    for name, fields in model.sleepy_relations.items():
+        rows = dict((pk, []) for pk in pks)
+        lookups = ['pk'] + ["{0}__{1}".format(name, field) for field in fields]
+
+        for values in (model._default_manager
+                       .filter(pk__in=pks)
+                       .values_list(*lookups)):
+            # Rows without any related object come back as one row of
+            # NULLs from the outer join
+            if all(value is None for value in values[1:]):
+                continue
+            rows[values[0]].append(dict(zip(fields, values[1:])))
+
+        related[name] = rows
+    return related
+
+
+def _serialize_values(queryset, streaming):
+    model = queryset.model
+    specs = field_specs(model)
+    relations = getattr(model, 'sleepy_relations', None)
+
+    rows = queryset.values_list('pk', *[lookup for lookup, _, _ in specs])
+    if streaming:
+        rows = rows.iterator()
+
+    for batch in _batches(rows, SERIALIZATION_BATCH_SIZE):
+        related = None
+        if relations:
+            related = _related_rows(model, [values[0] for values in batch])
+
+        for values in batch:
+            row = {}
+            for (lookup, keypath, transform), value in zip(specs, values[1:]):
+                if transform is not None and value is not None:
+                    value = transform(value)
+
+                if isinstance(keypath, basestring):
+                    row[keypath] = value
+                else:
+                    keypath.set(row, value, create_if_needed=True)
+
+            if related is not None:
+                for name, rows_for_relation in related.items():
+                    row[name] = rows_for_relation[values[0]]
+
+            yield values[0], row
+
+
+def prepare_queryset(queryset):
+    """
+    Applies the select_related and prefetch_related lookups a model
+    declares for its as_dict
+    """
+    model = queryset.model
+
+    select_related = getattr(model, 'sleepy_select_related', None)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+
+    prefetch_related = getattr(model, 'sleepy_prefetch_related', None)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+
+    return queryset
+
+
+def _serialize_instances(queryset, streaming):
+    queryset = prepare_queryset(queryset)
+
+    if not streaming:
+        for item in queryset.all():
+            yield item.pk, item.as_dict
+        return
+
+    # iterator() skips prefetch_related so prefetch batch by batch
+    prefetch_related = queryset._prefetch_related_lookups
+    for batch in _batches(queryset.iterator(), SERIALIZATION_BATCH_SIZE):
+        if prefetch_related:
+            prefetch_related_objects(batch, prefetch_related)
+        for item in batch:
+            yield item.pk, item.as_dict
+
+
+def serialize_rows(queryset, streaming=False):
+    """
+    Yields (pk, dictionary) for every row in queryset. Models that
+    declare sleepy_fields are read with values_list(), others through
+    their as_dict. With streaming the rows are read with iterator() so
+    that memory use doesn't grow with the size of the queryset.
+    """
+    if declares_fields(queryset.model):
+        return _serialize_values(queryset, streaming)
+
+    return _serialize_instances(queryset, streaming)
@@ -0,0 +1,309 @@
+"""
+Sleepy Incremental Sync
+
+Lets clients keep a copy of a collection up to date without
+downloading all of it on every poll. sync_out answers with the rows of
+a queryset ordered by a monotonic version column (an auto_now
+updated_at or a sequence) and an opaque token in the response's meta
+data:
+
+    {"data": [...],
+     "sync": {"token": "...", "full": true, "resync": false,
+              "deleted": [], "more": false}}
+
+A client sends the token back in the since parameter and gets only the
+rows created or changed since the token was issued. Models that soft
+delete rows by setting a deleted_field flag (and bumping the version)
+report those rows' ids in "deleted". With a limit, rows are sent a page
+at a time and "more" tells the client to ask again right away.
+
+Tokens are signed, tokens that were tampered with, belong to another
+model or are older than SLEEPY_SYNC_TOKEN_MAX_AGE (which should not
+exceed how long soft deleted rows are kept) get a full listing with
+"resync" set. Clients should then throw their copy away.
+
+Rows are sent once their transaction has surely committed: with a
+datetime version column, rows changed within the last SYNC_SETTLE_TIME
+seconds are left for the next poll and tokens never pass them, because
+a transaction that started earlier may still commit a row with an older
+version. Sequence versions are sent as soon as they are visible.
+
+Models must be registered with track_changes() when the app loads, for
+example at the bottom of models.py:
+
+    sync.track_changes(Story)
+
+Saving or deleting an instance then records the time its model last
+changed in the cache, in every process. A poll with a token issued well
+after that change (see SYNC_SETTLE_TIME) is answered from the cache
+without touching the database. Writes that don't send signals, such as
+update() and bulk_create(), should call changed() themselves. sync_out
+raises ImproperlyConfigured for models that aren't registered.
+"""
+
+# Universe imports
+import time
+from datetime import datetime, timedelta
+
+# Thirdparty imports
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import DateTimeField, Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+# Akimbo imports
+from caching import CACHE_TAG_TIMEOUT, model_label
+from context import current_request
+from responses import queryset_out
+
+# Seconds a sync token stays valid for
+SYNC_TOKEN_MAX_AGE = getattr(
+    settings,
+    'SLEEPY_SYNC_TOKEN_MAX_AGE',
+    60 * 60 * 24 * 30
+)
+
+# Seconds after a change within which the transaction that made it may
+# still be committing. Rows changed more recently aren't sent yet and
+# tokens issued sooner always query the database.
+SYNC_SETTLE_TIME = getattr(settings, 'SLEEPY_SYNC_SETTLE_TIME', 5)
+
+# The most rows sent per response, None sends every changed row
+SYNC_PAGE_SIZE = getattr(settings, 'SLEEPY_SYNC_PAGE_SIZE', None)
+
+SYNC_PARAM = 'since'
+SYNC_SALT = 'sleepy.sync'
+SYNC_CHANGE_PREFIX = 'sleepy:sync:'
+
+_tracked = set()
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def changed(model):
+    """
+    Records that rows of model were created, changed or deleted
+    """
+    cache.set(
+        SYNC_CHANGE_PREFIX + model_label(model),
+        _now(),
+        CACHE_TAG_TIMEOUT
+    )
+
+
+def _changed_on_signal(sender, **kwargs):
+    changed(sender)
+
+
+def track_changes(model):
+    """
+    Calls changed() whenever an instance of model is saved or deleted.
+    Call it when the app loads, see the module documentation. Returns
+    model.
+    """
+    if model in _tracked:
+        return model
+
+    uid = "sleepy.sync." + model_label(model)
+    post_save.connect(_changed_on_signal, sender=model, dispatch_uid=uid)
+    post_delete.connect(_changed_on_signal, sender=model, dispatch_uid=uid)
+    _tracked.add(model)
+    return model
+
+
+def _encode_version(version):
+    if isinstance(version, datetime):
+        return version.isoformat()
+    return version
+
+
+def sync_token(model, version, pk, changed_at):
+    """
+    Returns the token for a client that has seen every row of model up
+    to (version, pk)
+    """
+    return signing.dumps(
+        {
+            'm': model_label(model),
+            'v': _encode_version(version),
+            'p': pk,
+            'c': changed_at,
+            't': _now(),
+        },
+        salt=SYNC_SALT
+    )
+
+
+def read_token(token, model):
+    """
+    Returns the state a sync token was issued with or None when the
+    token isn't valid for model
+    """
+    try:
+        state = signing.loads(token, salt=SYNC_SALT, max_age=SYNC_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+    if state.get('m') != model_label(model):
+        return None
+
+    return state
+
+
+def _after(version_field, version, pk):
+    return (Q(**{version_field + '__gt': version})
+            | Q(**{version_field: version, 'pk__gt': pk}))
+
+
+def _up_to(version_field, version, pk):
+    return (Q(**{version_field + '__lt': version})
+            | Q(**{version_field: version, 'pk__lte': pk}))
+
+
+def _settled(model, version_field):
+    """
+    Returns a filter keeping the rows old enough to be sent, None when
+    version_field isn't a datetime
+    """
+    field = model._meta.get_field(version_field)
+    if not isinstance(field, DateTimeField):
+        return None
+
+    return Q(**{
+        version_field + '__lte':
+            timezone.now() - timedelta(seconds=SYNC_SETTLE_TIME)
+    })
+
+
+def sync_out(
+    queryset,
+    version_field,
+    deleted_field=None,
+    since=None,
+    limit=SYNC_PAGE_SIZE,
+    meta_data=None,
+    **kwargs):
+    """
+    Outputs the rows of queryset that changed since a sync token, see
+    the module documentation.
+
+    :Parameters:
+      queryset : QuerySet
+        The collection clients sync
+      version_field : string
+        A field whose value increases whenever a row changes
+      deleted_field : string
+        A boolean field set on soft deleted rows
+      since : string
+        The client's token, by default the since parameter of the
+        request being served
+      limit : integer
+        The most rows to send in one response
+      meta_data : dictionary
+        Meta data sent along with the sync state
+
+    Any other keyword arguments are passed on to queryset_out.
+    """
+    model = queryset.model
+    if model not in _tracked:
+        raise ImproperlyConfigured(
+            "{0} isn't registered with sleepy.sync.track_changes".format(
+                model_label(model)
+            )
+        )
+
+    if since is None:
+        request = current_request()
+        if request is not None:
+            since = request.REQUEST.get(SYNC_PARAM)
+
+    state = None
+    if since:
+        state = read_token(since, model)
+
+    # Read before querying so that a change made while we query is
+    # picked up by the next poll
+    changed_at = cache.get(SYNC_CHANGE_PREFIX + model_label(model))
+
+    sync = {
+        'full': state is None,
+        'resync': bool(since) and state is None,
+        'deleted': [],
+        'more': False,
+    }
+
+    meta_data = dict(meta_data or {})
+    meta_data['sync'] = sync
+
+    if (state is not None
+            and changed_at is not None
+            and state['c'] == changed_at
+            and state['t'] - changed_at > SYNC_SETTLE_TIME * 1000):
+        # Nothing changed since the token was issued
+        sync['token'] = since
+        return queryset_out(queryset.none(), meta_data, **kwargs)
+
+    rows = queryset
+    settled = _settled(model, version_field)
+    if settled is not None:
+        rows = rows.filter(settled)
+
+    if state is None:
+        if deleted_field is not None:
+            rows = rows.filter(**{deleted_field: False})
+    elif state['v'] is not None:
+        rows = rows.filter(_after(version_field, state['v'], state['p']))
+
+    keys = rows.order_by(version_field, 'pk').values_list(version_field, 'pk')
+
+    last = None
+    if limit:
+        window = list(keys[limit - 1:limit + 1])
+        if window:
+            last = window[0]
+            sync['more'] = len(window) > 1
+
+    if last is None:
+        latest = list(keys.reverse()[:1])
+        if latest:
+            last = latest[0]
+
+    if last is None:
+        # No rows changed, the client keeps its place
+        if state is None:
+            sync['token'] = sync_token(model, None, None, changed_at)
+        else:
+            sync['token'] = sync_token(
+                model,
+                state['v'],
+                state['p'],
+                changed_at
+            )
+        return queryset_out(queryset.none(), meta_data, **kwargs)
+
+    rows = rows.filter(_up_to(version_field, *last))
+
+    if deleted_field is not None and state is not None:
+        sync['deleted'] = list(
+            rows.filter(**{deleted_field: True}).values_list('pk', flat=True)
+        )
+        rows = rows.filter(**{deleted_field: False})
+
+    # Tokens for a page with more to come can't skip the database
+    sync['token'] = sync_token(
+        model,
+        last[0],
+        last[1],
+        None if sync['more'] else changed_at
+    )
+
+    return queryset_out(
+        rows.order_by(version_field, 'pk'),
+        meta_data,
+        **kwargs
+    )
@@ -0,0 +1,141 @@
+"""
+Sleepy Warm Up
+
+Does the work a worker otherwise does lazily on its first requests.
+warm_up() walks the URLconf, which imports every handler module and
+compiles every route regex. It builds the reverse lookup tables, lets
+each Base handler build its per class state and loads gitpython and the
+deployed commit for helpers.git_version. It can also replay a list of
+GET requests to prime CacheResponse.
+
+Replayed requests go through the middleware like any other request,
+with a host taken from SLEEPY_WARM_UP_HOST or ALLOWED_HOSTS so that
+they pass the host check under production settings.
+
+Call it from the project's wsgi module and run the server with a
+preloading, forking worker model (such as gunicorn --preload) to warm
+the master once. Forked workers then share the warmed state copy on
+write instead of each warming up on live traffic:
+
+    application = get_wsgi_application()
+
+    from sleepy.warmup import warm_up
+    try:
+        warm_up()
+    except Exception:
+        logging.getLogger('sleepy.warmup').exception("warm up failed")
+
+A failed warm up shouldn't keep the workers from serving.
+"""
+
+# Universe imports
+import gc
+import sys
+
+# Thirdparty imports
+from django.conf import settings
+from django.core.urlresolvers import get_resolver, RegexURLResolver
+from django.test.client import Client
+
+# Akimbo imports
+from base import Base
+from router import Router
+
+# Paths replayed by warm_up when it isn't given any
+WARM_UP_URLS = getattr(settings, 'SLEEPY_WARM_UP_URLS', [])
+
+# The host replayed requests are sent to, by default the first host in
+# ALLOWED_HOSTS
+WARM_UP_HOST = getattr(settings, 'SLEEPY_WARM_UP_HOST', None)
+
+
+def iter_patterns(resolver=None):
+    """
+    Yields every url pattern reachable from resolver (by default the
+    root URLconf), importing each included URLconf and compiling each
+    pattern's regex along the way
+    """
+    if resolver is None:
+        resolver = get_resolver(None)
+
+    for pattern in resolver.url_patterns:
+        # Regexes compile lazily on first access
+        pattern.regex
+
+        if isinstance(pattern, RegexURLResolver):
+            for sub_pattern in iter_patterns(pattern):
+                yield sub_pattern
+        else:
+            yield pattern
+
+
+def warm_up_host():
+    """
+    Returns the host replayed requests are sent to
+    """
+    if WARM_UP_HOST is not None:
+        return WARM_UP_HOST
+
+    for host in settings.ALLOWED_HOSTS:
+        # A leading '.' also allows the domain itself
+        host = host.lstrip('.')
+        if host and host != '*':
+            return host
+
+    return 'localhost'
+
+
+def load_git_version():
+    """
+    Imports gitpython and reads the commit helpers.git_version reports
+    from the repository holding the settings module
+    """
+    import helpers
+
+    module = sys.modules.get(getattr(settings, 'SETTINGS_MODULE', None))
+    if module is not None:
+        helpers.git_version(None, module.__file__)
+
+
+def warm_up(replay=None):
+    """
+    Warms up this process, see the module documentation. replay is a
+    list of paths to GET (WARM_UP_URLS by default). Returns a summary
+    of the work done.
+    """
+    summary = {'patterns': 0, 'handlers': 0, 'replayed': []}
+
+    resolver = get_resolver(None)
+    for pattern in iter_patterns(resolver):
+        summary['patterns'] += 1
+
+        # Importing a string callback imports its module
+        callback = pattern.callback
+        if isinstance(callback, Base):
+            callback.warm_up()
+            summary['handlers'] += 1
+        elif isinstance(callback, Router):
+            callback.warm_up()
+            summary['handlers'] += len(callback.routes)
+
+    # Builds the reverse() lookup tables
+    resolver.reverse_dict
+
+    load_git_version()
+
+    if replay is None:
+        replay = WARM_UP_URLS
+
+    client = Client(HTTP_HOST=warm_up_host())
+    for path in replay:
+        try:
+            status = client.get(path).status_code
+        except Exception as e:
+            status = repr(e)
+        summary['replayed'].append((path, status))
+
+    # Collect now so that forked workers don't dirty shared pages by
+    # collecting the warm up's garbage themselves
+    gc.collect()
+
+    return summary
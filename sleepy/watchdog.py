@@ -0,0 +1,258 @@
+"""
+Sleepy Slow Request Watchdog
+
+Finds out why individual requests are slow. Base registers every
+request it serves while SLEEPY_SLOW_REQUEST_THRESHOLD is set. A
+background thread looks at the requests in flight and once one has
+been running longer than the threshold it samples the stack of the
+thread serving it every SLEEPY_SLOW_REQUEST_INTERVAL seconds. Samples
+are folded ("module:function:line;...") and counted, the format flame
+graph tools read.
+
+A structured record is logged to the sleepy.slow_requests logger when
+a request first crosses the threshold and again when it finishes. The
+record holds the handler, method, redacted parameters, the time spent
+in each phase and the stack samples. Records are handed to a writer
+thread through a bounded queue so logging never blocks a request, when
+the queue is full records are dropped.
+"""
+
+# Universe imports
+import os
+import sys
+import json
+import time
+import Queue
+import logging
+import threading
+from collections import defaultdict
+
+# Thirdparty imports
+from django.conf import settings
+
+# Seconds a request may run before it's reported, None turns the
+# watchdog off
+SLOW_REQUEST_THRESHOLD = getattr(settings, 'SLEEPY_SLOW_REQUEST_THRESHOLD', None)
+
+# Seconds between stack samples of a slow request
+SLOW_REQUEST_INTERVAL = getattr(settings, 'SLEEPY_SLOW_REQUEST_INTERVAL', 0.1)
+
+# Parameters whose name contains any of these are redacted
+SLOW_REQUEST_REDACT = getattr(
+    settings,
+    'SLEEPY_SLOW_REQUEST_REDACT',
+    ('password', 'secret', 'token', 'key', 'auth', 'session')
+)
+
+SLOW_REQUEST_QUEUE_SIZE = getattr(settings, 'SLEEPY_SLOW_REQUEST_QUEUE_SIZE', 1000)
+
+WATCHDOG_ENABLED = SLOW_REQUEST_THRESHOLD is not None
+
+logger = logging.getLogger('sleepy.slow_requests')
+
+_local = threading.local()
+_in_flight = {}
+_records = Queue.Queue(SLOW_REQUEST_QUEUE_SIZE)
+_threads = {'pid': None}
+_threads_lock = threading.Lock()
+
+
+class RequestWatch(object):
+    """
+    What the watchdog knows about one request in flight
+    """
+
+    def __init__(self, handler, request):
+        self.thread_id = threading.current_thread().ident
+        self.handler = "{0}.{1}".format(
+            handler.__class__.__module__,
+            handler.__class__.__name__
+        )
+        self.request = request
+        self.started_at = time.time()
+        self.phases = [('start', self.started_at)]
+        self.samples = defaultdict(int)
+        self.reported = False
+        self.finished_at = None
+
+    def mark(self, phase):
+        self.phases.append((phase, time.time()))
+
+    def is_slow(self, now):
+        return now - self.started_at >= SLOW_REQUEST_THRESHOLD
+
+    def record(self, status):
+        """
+        Returns the structured record that is logged for this request
+        """
+        ended_at = self.finished_at or time.time()
+        marks = self.phases + [('end', ended_at)]
+        return {
+            'status': status,
+            'handler': self.handler,
+            'method': self.request.method,
+            'path': self.request.path,
+            'params': redact(self.request.REQUEST),
+            'started_at': self.started_at,
+            'duration': ended_at - self.started_at,
+            'phases': [
+                {'phase': phase, 'duration': marks[ii + 1][1] - started}
+                for ii, (phase, started)
+                in enumerate(marks[:-1])],
+            'stacks': dict(self.samples),
+        }
+
+
+def redact(params):
+    """
+    Returns a copy of params with the values of sensitive parameters
+    replaced and long values truncated
+
+    >>> redact({'api_key': 'abc', 'q': 'x' * 300})['api_key']
+    '[redacted]'
+    """
+    redacted = {}
+    for name in params:
+        lowered = name.lower()
+        if any(word in lowered for word in SLOW_REQUEST_REDACT):
+            redacted[name] = '[redacted]'
+        else:
+            redacted[name] = params[name][:200]
+    return redacted
+
+
+def fold_stack(frame):
+    """
+    Returns a frame's stack as a single "module:function:line;..." string
+    with the outermost call first
+    """
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append("{0}:{1}:{2}".format(
+            os.path.basename(code.co_filename),
+            code.co_name,
+            frame.f_lineno
+        ))
+        frame = frame.f_back
+    calls.reverse()
+    return ";".join(calls)
+
+
+def _emit(record):
+    try:
+        _records.put_nowait(record)
+    except Queue.Full:
+        pass
+
+
+def _watch():
+    """
+    The watchdog thread, samples the stacks of slow requests
+    """
+    while True:
+        try:
+            time.sleep(SLOW_REQUEST_INTERVAL)
+            _sample()
+        except Exception:
+            # Module globals are torn down under daemon threads when the
+            # interpreter exits
+            if time is None:
+                return
+
+
+def _sample():
+    now = time.time()
+    slow = [watch for watch in _in_flight.values() if watch.is_slow(now)]
+    if not slow:
+        return
+
+    frames = sys._current_frames()
+    for watch in slow:
+        frame = frames.get(watch.thread_id)
+        if frame is None or watch.finished_at is not None:
+            continue
+
+        watch.samples[fold_stack(frame)] += 1
+
+        if not watch.reported:
+            watch.reported = True
+            _emit(watch.record('running'))
+
+
+def _write():
+    """
+    The writer thread, logs records off the request path
+    """
+    while True:
+        record = _records.get()
+        try:
+            logger.warning(json.dumps(record))
+        except Exception:
+            pass
+        finally:
+            _records.task_done()
+
+
+def _ensure_started():
+    # Threads don't survive a fork so every worker starts its own
+    if _threads['pid'] == os.getpid():
+        return
+
+    with _threads_lock:
+        if _threads['pid'] == os.getpid():
+            return
+
+        for name, target in [('sleepy-watchdog', _watch),
+                             ('sleepy-watchdog-writer', _write)]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+
+        _threads['pid'] = os.getpid()
+
+
+def start(handler, request):
+    """
+    Starts watching the request the current thread is serving. Returns
+    None when the thread is already watched, which happens when one
+    handler calls another.
+    """
+    if getattr(_local, 'watch', None) is not None:
+        return None
+
+    _ensure_started()
+
+    watch = RequestWatch(handler, request)
+    _in_flight[watch.thread_id] = watch
+    _local.watch = watch
+    return watch
+
+
+def mark(phase):
+    """
+    Records that the current request entered a new phase, a no-op when
+    the request isn't being watched
+    """
+    watch = getattr(_local, 'watch', None)
+    if watch is not None:
+        watch.mark(phase)
+
+
+def finish(watch):
+    """
+    Stops watching a request and logs it if it was slow
+    """
+    watch.finished_at = time.time()
+    _in_flight.pop(watch.thread_id, None)
+    _local.watch = None
+
+    if watch.finished_at - watch.started_at >= SLOW_REQUEST_THRESHOLD:
+        _emit(watch.record('finished'))
+
+
+def flush():
+    """
+    Blocks until every queued record has been logged
+    """
+    _records.join()
@@ -0,0 +1,136 @@
+"""
+Compares the keypath helpers with the implementation they replaced,
+which split the keypath on every call:
+
+    python manage.py bench_keypath --records 1000
+"""
+
+# Universe imports
+import copy
+import timeit
+from optparse import make_option
+
+# Third party imports
+from django.core.management.base import BaseCommand
+
+# Akimbo imports
+from sleepy.helpers import (
+    value_for_keypath,
+    set_value_for_keypath,
+    values_for_keypath,
+    set_values_for_keypath
+)
+
+
+def baseline_value_for_keypath(dict, keypath):
+    if len(keypath) == 0:
+        return dict
+    keys = keypath.split('.')
+    value = dict
+    for key in keys:
+        if key in value:
+            value = value[key]
+        else:
+            return None
+    return value
+
+
+def baseline_set_value_for_keypath(dict_, keypath, value, create_if_needed=False):
+    if len(keypath) == 0:
+        return None
+
+    keys = keypath.split('.')
+    if len(keys) > 1:
+        key = keys[0]
+
+        if create_if_needed:
+            dict_[key] = dict_.get(key, {})
+
+        if key in dict_:
+            if baseline_set_value_for_keypath(
+                    dict_[key], '.'.join(keys[1:]), value,
+                    create_if_needed=create_if_needed):
+                return dict_
+        return None
+
+    if create_if_needed or keypath in dict_:
+        dict_[keypath] = value
+        return dict_
+    return None
+
+
+def baseline_values_for_keypath(records, keypath):
+    return [baseline_value_for_keypath(record, keypath) for record in records]
+
+
+def baseline_set_values_for_keypath(records, keypath, values):
+    updated = 0
+    for record, value in zip(records, values):
+        if baseline_set_value_for_keypath(record, keypath, value) is not None:
+            updated += 1
+    return updated
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the keypath helpers against the split per call version"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--records', type='int', default=1000,
+                    help="Records per extract and assign"),
+        make_option('--repeat', type='int', default=5,
+                    help="Timing runs, the fastest is reported"),
+    )
+
+    def handle(self, *args, **options):
+        keypath = 'story.author.name'
+        document = {'story': {'author': {'name': 'Ann'}, 'title': 'Hello'}}
+        records = [copy.deepcopy(document) for _ in range(options['records'])]
+        names = ['name {0}'.format(ii) for ii in range(len(records))]
+
+        # operation, new, baseline, calls per run, unit
+        cases = [
+            ('get',
+             lambda: value_for_keypath(document, keypath),
+             lambda: baseline_value_for_keypath(document, keypath),
+             100000, 'us'),
+            ('get missing',
+             lambda: value_for_keypath(document, 'story.editor.name'),
+             lambda: baseline_value_for_keypath(document, 'story.editor.name'),
+             100000, 'us'),
+            ('set',
+             lambda: set_value_for_keypath(document, keypath, 'Bo'),
+             lambda: baseline_set_value_for_keypath(document, keypath, 'Bo'),
+             100000, 'us'),
+            ('extract',
+             lambda: values_for_keypath(records, keypath),
+             lambda: baseline_values_for_keypath(records, keypath),
+             200, 'ms'),
+            ('assign',
+             lambda: set_values_for_keypath(records, keypath, names),
+             lambda: baseline_set_values_for_keypath(records, keypath, names),
+             200, 'ms'),
+        ]
+
+        scale = {'us': 1e6, 'ms': 1e3}
+
+        self.stdout.write("{0} records per extract and assign".format(
+            len(records)))
+        self.stdout.write("  {0:<12} {1:>10} {2:>10} {3:>8}".format(
+            "operation", "baseline", "keypath", "speedup"))
+
+        for label, new, baseline, number, unit in cases:
+            timings = []
+            for work in (baseline, new):
+                best = min(timeit.repeat(
+                    work, number=number, repeat=options['repeat']))
+                timings.append(best / number * scale[unit])
+
+            self.stdout.write(
+                "  {0:<12} {1:>8.2f}{4} {2:>8.2f}{4} {3:>7.2f}x".format(
+                    label,
+                    timings[0],
+                    timings[1],
+                    timings[0] / timings[1],
+                    unit
+                )
+            )
@@ -0,0 +1,114 @@
+"""
+Times the ways queryset_out can serialize stories on a throwaway copy
+of the test project's database:
+
+    python manage.py bench_queryset_out --rows 10000
+"""
+
+# Universe imports
+import json
+import time
+from optparse import make_option
+
+# Third party imports
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+
+# Akimbo imports
+from sleepy.serialization import serialize_rows
+from test_project.testapp.models import Author, Story, Tag
+
+
+class Command(BaseCommand):
+    help = "Benchmarks queryset_out serialization on a test database"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=10000,
+                    help="Number of stories to serialize"),
+        make_option('--repeat', type='int', default=3,
+                    help="Runs per path, the best run is reported"),
+    )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        old_name = connection.creation.create_test_db(verbosity=0)
+        connection.use_debug_cursor = True
+        try:
+            self.populate(rows)
+
+            paths = [
+                ("as_dict", lambda: [
+                    story.as_dict
+                    for story
+                    in Story.objects.order_by('pk')]),
+                ("as_dict + select/prefetch_related", lambda: [
+                    story.as_dict
+                    for story
+                    in (Story.objects
+                        .order_by('pk')
+                        .select_related('author')
+                        .prefetch_related('tags'))]),
+                ("sleepy_fields + values_list", lambda: [
+                    row
+                    for _pk, row
+                    in serialize_rows(Story.objects.order_by('pk'))]),
+            ]
+
+            self.stdout.write(
+                "{0:<36} {1:>8} {2:>10} {3:>14}".format(
+                    "path", "queries", "seconds", "sec/10k rows"
+                )
+            )
+            for label, serialize in paths:
+                queries, seconds = self.measure(serialize, options['repeat'])
+                self.stdout.write(
+                    "{0:<36} {1:>8} {2:>10.3f} {3:>14.3f}".format(
+                        label,
+                        queries,
+                        seconds,
+                        seconds * 10000 / rows
+                    )
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def populate(self, rows):
+        Author.objects.bulk_create(
+            [Author(name="author {0}".format(ii)) for ii in range(100)]
+        )
+        authors = list(Author.objects.all())
+        Tag.objects.bulk_create(
+            [Tag(name="tag {0}".format(ii)) for ii in range(20)]
+        )
+        tags = list(Tag.objects.all())
+
+        Story.objects.bulk_create([
+            Story(
+                title="story {0}".format(ii),
+                author=authors[ii % len(authors)]
+            )
+            for ii
+            in range(rows)
+        ])
+
+        Through = Story.tags.through
+        Through.objects.bulk_create([
+            Through(story_id=story_id, tag_id=tags[(story_id + jj) % len(tags)].pk)
+            for story_id
+            in Story.objects.values_list('pk', flat=True)
+            for jj
+            in range(3)
+        ])
+
+    def measure(self, serialize, repeat):
+        best = None
+        for _ in range(repeat):
+            reset_queries()
+            started = time.time()
+            json.dumps(serialize())
+            elapsed = time.time() - started
+            queries = len(connection.queries)
+            if best is None or elapsed < best:
+                best = elapsed
+        return queries, best
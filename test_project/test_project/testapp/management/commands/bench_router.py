@@ -0,0 +1,93 @@
+"""
+Compares resolving paths through Django's regex URL patterns with
+resolving them through a sleepy Router holding the same routes:
+
+    python manage.py bench_router --routes 1000
+"""
+
+# Universe imports
+import time
+import random
+from optparse import make_option
+
+# Third party imports
+from django.conf.urls import url
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import RegexURLResolver
+
+# Akimbo imports
+from sleepy.router import Router
+
+
+def handler(request, *args, **kwargs):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the sleepy router against regex url patterns"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--routes', type='int', default=1000,
+                    help="Number of routes registered"),
+        make_option('--lookups', type='int', default=2000,
+                    help="Paths resolved per router"),
+    )
+
+    def handle(self, *args, **options):
+        routes = options['routes']
+
+        # Half the routes are collections, half take a typed id
+        patterns = []
+        router = Router()
+        for ii in range(routes // 2):
+            patterns.append(url(r'^resource{0}$'.format(ii), handler))
+            patterns.append(
+                url(r'^resource{0}/(?P<id>\d+)$'.format(ii), handler)
+            )
+            router.register('/resource{0}'.format(ii), handler)
+            router.register('/resource{0}/{{id:int}}'.format(ii), handler)
+
+        regex_resolver = RegexURLResolver(r'^/', patterns)
+        trie_resolver = RegexURLResolver(r'^/', router.urls)
+
+        rng = random.Random(0)
+        paths = []
+        for _ in range(options['lookups']):
+            ii = rng.randrange(routes // 2)
+            if rng.random() < 0.5:
+                paths.append('/resource{0}'.format(ii))
+            else:
+                paths.append('/resource{0}/{1}'.format(ii, rng.randrange(1000)))
+
+        last = '/resource{0}/7'.format(routes // 2 - 1)
+
+        self.stdout.write(
+            "{0} routes, {1} lookups".format(routes, len(paths))
+        )
+        self.stdout.write(
+            "  {0:<8} {1:>14} {2:>18}".format(
+                "router", "us per lookup", "us for last route"
+            )
+        )
+        for label, resolver in [('regex', regex_resolver),
+                                ('trie', trie_resolver)]:
+            # Compiles the regexes and checks both agree
+            assert resolver.resolve(last).kwargs['id'] in ('7', 7)
+
+            started = time.time()
+            for path in paths:
+                resolver.resolve(path)
+            mean = (time.time() - started) / len(paths)
+
+            started = time.time()
+            for _ in range(1000):
+                resolver.resolve(last)
+            worst = (time.time() - started) / 1000
+
+            self.stdout.write(
+                "  {0:<8} {1:>14.2f} {2:>18.2f}".format(
+                    label,
+                    mean * 1e6,
+                    worst * 1e6
+                )
+            )
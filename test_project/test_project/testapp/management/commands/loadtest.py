@@ -0,0 +1,272 @@
+"""
+Serves the test project through a local WSGI server and drives it with
+concurrent clients to measure throughput and tail latency:
+
+    python manage.py loadtest --clients 16 --requests 4000
+    python manage.py loadtest --workers process --processes 4 \\
+        --mix complex=1,cached=1
+
+The server runs in forked worker processes, either one process serving
+each request in a thread (threaded) or several single threaded
+processes sharing the listening socket (process). --workers both runs
+the same load against each model so they can be compared.
+"""
+
+# Universe imports
+import os
+import time
+import random
+import signal
+import httplib
+import threading
+from optparse import make_option
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+# Third party imports
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+# The requests a mix can be made of: (method, path, headers)
+REQUEST_KINDS = {
+    'complex': ('GET', '/complex_test_list', {}),
+    'cached': ('GET', '/cached_complex_test_list', {}),
+    'cors': ('GET', '/cors_test', {'Origin': 'http://example.com'}),
+    'preflight': ('OPTIONS', '/cors_test', {
+        'Origin': 'http://example.com',
+        'Access-Control-Request-Method': 'POST',
+    }),
+}
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestWSGIServer(WSGIServer):
+    # The default backlog of 5 refuses connections under load
+    request_queue_size = 256
+
+
+class ThreadingLoadTestWSGIServer(ThreadingMixIn, LoadTestWSGIServer):
+    daemon_threads = True
+
+
+def percentile(latencies, pct):
+    """
+    Returns the pct percentile of a sorted list of latencies
+    """
+    if not latencies:
+        return 0.0
+    return latencies[int(round(pct / 100.0 * (len(latencies) - 1)))]
+
+
+class Command(BaseCommand):
+    help = "Load tests the test project and reports latency percentiles"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--clients', type='int', default=16,
+                    help="Number of concurrent clients"),
+        make_option('--requests', type='int', default=2000,
+                    help="Requests sent per worker model"),
+        make_option('--workers', default='both',
+                    choices=['threaded', 'process', 'both'],
+                    help="Worker model to serve the project with"),
+        make_option('--processes', type='int', default=4,
+                    help="Worker processes for the process model"),
+        make_option('--mix', default='complex=4,cached=4,cors=2,preflight=1',
+                    help="Weighted request mix, kind=weight,... of "
+                         + ", ".join(sorted(REQUEST_KINDS))),
+    )
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+
+        if options['workers'] == 'both':
+            models = ['threaded', 'process']
+        else:
+            models = [options['workers']]
+
+        for model in models:
+            port, pids = self.serve(model, options['processes'])
+            try:
+                self.warm_up(port, mix)
+                results, elapsed = self.drive(
+                    port,
+                    mix,
+                    options['clients'],
+                    options['requests']
+                )
+            finally:
+                for pid in pids:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+
+            self.report(
+                "{0} ({1})".format(
+                    model,
+                    "1 process" if model == 'threaded'
+                    else "{0} processes".format(options['processes'])
+                ),
+                results,
+                elapsed
+            )
+
+    def parse_mix(self, spec):
+        mix = []
+        for part in spec.split(','):
+            kind, _separator, weight = part.partition('=')
+            if kind not in REQUEST_KINDS:
+                raise CommandError("unknown request kind {0}".format(kind))
+            try:
+                mix.extend([kind] * int(weight or 1))
+            except ValueError:
+                raise CommandError("bad weight in {0}".format(part))
+        return mix
+
+    def serve(self, model, processes):
+        """
+        Forks the worker processes for a worker model, returns the port
+        they listen on and their pids
+        """
+        if model == 'threaded':
+            server_class = ThreadingLoadTestWSGIServer
+            processes = 1
+        else:
+            server_class = LoadTestWSGIServer
+
+        server = make_server(
+            '127.0.0.1',
+            0,
+            WSGIHandler(),
+            server_class,
+            QuietRequestHandler
+        )
+
+        pids = []
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+
+        port = server.server_address[1]
+        server.socket.close()
+        return port, pids
+
+    def request(self, port, kind):
+        method, path, headers = REQUEST_KINDS[kind]
+        connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def warm_up(self, port, mix):
+        for kind in set(mix):
+            for _ in range(5):
+                self.request(port, kind)
+
+    def drive(self, port, mix, clients, requests):
+        """
+        Sends requests from concurrent clients, returns the latency in
+        milliseconds of each request kind and the elapsed seconds
+        """
+        rng = random.Random(0)
+        plan = [rng.choice(mix) for _ in range(requests)]
+        plan_lock = threading.Lock()
+        results = dict((kind, []) for kind in set(mix))
+        results['errors'] = []
+
+        def client():
+            while True:
+                with plan_lock:
+                    if not plan:
+                        return
+                    kind = plan.pop()
+
+                started = time.time()
+                try:
+                    status = self.request(port, kind)
+                except Exception:
+                    status = None
+                latency = (time.time() - started) * 1000
+
+                if status is None or status >= 500:
+                    results['errors'].append(latency)
+                else:
+                    results[kind].append(latency)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results, time.time() - started
+
+    def report(self, label, results, elapsed):
+        errors = results.pop('errors')
+        everything = sorted(sum(results.values(), []))
+
+        self.stdout.write("")
+        self.stdout.write(
+            "{0}: {1} requests in {2:.2f}s, {3:.1f} req/s, {4} errors".format(
+                label,
+                len(everything),
+                elapsed,
+                len(everything) / elapsed,
+                len(errors)
+            )
+        )
+
+        self.stdout.write(
+            "  {0:<12} {1:>7} {2:>9} {3:>9} {4:>9}".format(
+                "kind", "count", "p50 ms", "p95 ms", "p99 ms"
+            )
+        )
+        for kind, latencies in sorted(results.items()) + [('all', everything)]:
+            latencies = sorted(latencies)
+            self.stdout.write(
+                "  {0:<12} {1:>7} {2:>9.2f} {3:>9.2f} {4:>9.2f}".format(
+                    kind,
+                    len(latencies),
+                    percentile(latencies, 50),
+                    percentile(latencies, 95),
+                    percentile(latencies, 99)
+                )
+            )
+
+        self.stdout.write("  latency histogram")
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for latency in everything:
+            for ii, bound in enumerate(HISTOGRAM_BUCKETS):
+                if latency <= bound:
+                    counts[ii] += 1
+                    break
+            else:
+                counts[-1] += 1
+
+        labels = ["<= {0} ms".format(bound) for bound in HISTOGRAM_BUCKETS]
+        labels.append("> {0} ms".format(HISTOGRAM_BUCKETS[-1]))
+        widest = max(counts) or 1
+        for bucket, count in zip(labels, counts):
+            if count:
+                self.stdout.write(
+                    "  {0:>12} {1:>7} {2}".format(
+                        bucket,
+                        count,
+                        "#" * int(round(40.0 * count / widest))
+                    )
+                )
@@ -1,3 +1,43 @@
 from django.db import models
 
-# Create your models here.
+from sleepy import sync
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=200)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=200)
+
+
+class Story(models.Model):
+    title = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True)
+    author = models.ForeignKey(Author, null=True)
+    tags = models.ManyToManyField(Tag)
+    deleted = models.BooleanField(default=False)
+
+    # Lets queryset_out serialize stories with values_list(), see
+    # sleepy.serialization
+    sleepy_fields = ('id', 'title', 'author__name')
+    sleepy_relations = {'tags': ('id', 'name')}
+
+    @property
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "title": self.title,
+            "author": {
+                "name": self.author.name if self.author else None,
+            },
+            "tags": [
+                {"id": tag.pk, "name": tag.name}
+                for tag
+                in self.tags.all()
+            ],
+        }
+
+
+# Keeps the change marker sync_out reads current in every process
+sync.track_changes(Story)
@@ -6,8 +6,1042 @@ Replace this with more appropriate tests for your application.
 """
 
 # Universe imports
+import os
+import datetime
 import json
+import shutil
+import logging
+import tempfile
+import threading
+import time
 import urlparse
+import unittest
 
 # Third party imports
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import NoReverseMatch, reverse
 from django.test import TestCase, Client
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Akimbo imports
+from sleepy import admission, coalescing, deadlines, profiling, sync, watchdog
+from sleepy import warmup
+from sleepy.base import Base
+from sleepy.caching import (
+    invalidate_tags,
+    refresh_request,
+    request_cache_key,
+    rows_by_id
+)
+from sleepy.decorators import CircuitBreaker
+from sleepy.helpers import apply_patch, git_version
+from sleepy.patching import flatten_json_patch
+from sleepy.renderers import encode_msgpack, packb, renderer_for_request
+from sleepy.responses import api_error, queryset_out
+from sleepy.router import Router
+from sleepy.warmup import warm_up
+from test_project.testapp.models import Author, Story, Tag
+from test_project.testapp.views import (
+    CoalescedHandler,
+    CORSTest,
+    DeadlineHandler,
+    FlakyHandler,
+    LimitedHandler,
+    SlowHandler,
+    StaleHandler,
+    StoryHandler,
+    StoryListHandler,
+    SyncStoryHandler,
+    TableListHandler,
+    TaggedStoryHandler
+)
+
+
+class HandlerTestCase(TestCase):
+    """
+    Calls handlers directly with RequestFactory requests, the cache is
+    cleared around every test
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, handler, path, data=None, headers=None, **kwargs):
+        request = self.factory.get(path, data or {}, **(headers or {}))
+        return handler(request, **kwargs)
+
+    def send(self, handler, method, path, body,
+             content_type='application/json', **kwargs):
+        request = self.factory.generic(
+            method,
+            path,
+            json.dumps(body),
+            content_type=content_type
+        )
+        return handler(request, **kwargs)
+
+    def content(self, response):
+        return json.loads(response.content)
+
+    def lines(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [
+            json.loads(line)
+            for line
+            in "".join(response.streaming_content).splitlines()]
+
+
+class AdmissionControlTest(HandlerTestCase):
+    def tearDown(self):
+        admission.set_read_only(False)
+        super(AdmissionControlTest, self).tearDown()
+
+    def test_lower_priorities_are_shed_first(self):
+        limiter = admission.ConcurrencyLimiter(4)
+
+        for _ in range(3):
+            self.assertTrue(limiter.acquire(admission.PRIORITY_WRITE))
+
+        self.assertFalse(limiter.acquire(admission.PRIORITY_WRITE))
+        self.assertTrue(limiter.acquire(admission.PRIORITY_READ))
+        self.assertFalse(limiter.acquire(admission.PRIORITY_READ))
+
+    def test_overloaded_handler_is_shed(self):
+        handler = LimitedHandler()
+        limiter = handler._admission_limiters()[-1]
+
+        self.assertTrue(limiter.acquire())
+        try:
+            response = self.get(handler, '/limited')
+        finally:
+            limiter.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(
+            self.content(response)['error']['type'],
+            "Overloaded Error"
+        )
+
+        self.assertEqual(self.get(handler, '/limited').status_code, 200)
+
+    def test_runtime_read_only_flag(self):
+        handler = CORSTest()
+
+        admission.set_read_only(True)
+        response = handler(self.factory.post('/cors_test'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(handler, '/cors_test').status_code, 200)
+
+        admission.set_read_only(False)
+        self.assertEqual(handler(self.factory.post('/cors_test')).status_code, 405)
+
+
+class CacheTagTest(HandlerTestCase):
+    def setUp(self):
+        super(CacheTagTest, self).setUp()
+        self.handler = TaggedStoryHandler()
+
+    def renders(self, id_):
+        response = self.get(self.handler, '/stories/tagged', id=id_)
+        return self.content(response)['data']['renders']
+
+    def test_write_invalidates_tagged_responses(self):
+        first = self.renders(1)
+        other = self.renders(2)
+        self.assertEqual(self.renders(1), first)
+
+        self.handler(self.factory.post('/stories/tagged'), id=1)
+
+        self.assertNotEqual(self.renders(1), first)
+        self.assertEqual(self.renders(2), other)
+
+    def test_invalidate_shared_tag(self):
+        first = self.renders(3)
+        invalidate_tags("stories")
+        self.assertNotEqual(self.renders(3), first)
+
+    def test_http_cache_headers(self):
+        response = self.get(self.handler, '/stories/tagged', id=4)
+
+        self.assertEqual(
+            set(response['Cache-Control'].split(", ")),
+            set(["public", "max-age=3600", "stale-while-revalidate=60"])
+        )
+        self.assertEqual(response['Vary'], "Accept, Origin")
+        self.assertEqual(response['Surrogate-Key'], "stories story:4")
+
+        # Each origin gets its own CORS header from shared caches too
+        response = self.get(
+            self.handler,
+            '/stories/tagged',
+            headers={'HTTP_ORIGIN': 'http://a.example'},
+            id=4
+        )
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'http://a.example')
+        self.assertTrue('Origin' in response['Vary'])
+
+        response = self.get(self.handler, '/stories/tagged', id=4)
+        self.assertEqual(response['Age'], '0')
+
+    def test_representations_are_cached_separately(self):
+        json_response = self.get(self.handler, '/stories/formats', id=5)
+        self.assertEqual(json_response['Content-Type'], 'application/json')
+
+        for data, headers in [
+                ({'format': 'msgpack'}, None),
+                (None, {'HTTP_ACCEPT': 'application/x-msgpack'})]:
+            response = self.get(
+                self.handler, '/stories/formats', data, headers, id=5)
+            self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+
+
+class FragmentCacheTest(HandlerTestCase):
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        for title in ["first", "second", "third"]:
+            Story.objects.create(title=title)
+
+    def titles(self, queryset, **kwargs):
+        content = self.content(queryset_out(queryset, {"count": 3}, **kwargs))
+        self.assertEqual(content['count'], 3)
+        return [story['title'] for story in content['data']]
+
+    def test_fragments_match_uncached_output(self):
+        queryset = Story.objects.order_by('-pk')
+        self.assertEqual(
+            self.titles(queryset, fragment_cache='updated_at'),
+            self.titles(queryset)
+        )
+
+    def test_rows_are_reencoded_when_their_version_changes(self):
+        queryset = Story.objects.order_by('pk')
+        self.titles(queryset, fragment_cache='updated_at')
+
+        # update() doesn't touch updated_at so the cached row is served
+        Story.objects.filter(title="first").update(title="stale")
+        self.assertEqual(
+            self.titles(queryset, fragment_cache='updated_at'),
+            ["first", "second", "third"]
+        )
+
+        story = Story.objects.get(title="stale")
+        story.title = "fresh"
+        story.save()
+        self.assertEqual(
+            self.titles(queryset, fragment_cache='updated_at'),
+            ["fresh", "second", "third"]
+        )
+
+
+class NDJSONTest(HandlerTestCase):
+    def setUp(self):
+        super(NDJSONTest, self).setUp()
+        for title in ["first", "second"]:
+            Story.objects.create(title=title)
+
+    def test_accept_header_streams_records(self):
+        lines = self.lines(
+            self.get(
+                StoryListHandler(),
+                '/stories',
+                headers={'HTTP_ACCEPT': 'application/x-ndjson'}
+            )
+        )
+        self.assertEqual(lines[0], {"meta": {"count": 2}})
+        self.assertEqual(
+            [line['title'] for line in lines[1:]],
+            ["first", "second"]
+        )
+
+    def test_format_parameter_streams_records(self):
+        response = self.get(StoryListHandler(), '/stories?format=ndjson')
+        self.assertEqual(len(self.lines(response)), 3)
+
+    def test_only_record_outputs_stream(self):
+        response = self.get(CORSTest(), '/cors_test?format=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(
+            self.content(response)['data'],
+            {"does it work?": "yes"}
+        )
+
+    def test_streams_hold_their_admission_until_closed(self):
+        handler = LimitedHandler()
+        limiter = handler._admission_limiters()[-1]
+
+        response = self.get(handler, '/limited?format=ndjson')
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertEqual(len(self.lines(response)), 3)
+
+        response.close()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_json_is_still_the_default(self):
+        response = self.get(StoryListHandler(), '/stories')
+        self.assertEqual(len(self.content(response)['data']), 2)
+
+
+class RendererTest(HandlerTestCase):
+    def test_accept_header_selects_renderer(self):
+        request = self.factory.get(
+            '/',
+            HTTP_ACCEPT='application/json;q=0.9, application/x-msgpack'
+        )
+        self.assertEqual(renderer_for_request(request).name, 'msgpack')
+
+        request = self.factory.get('/', HTTP_ACCEPT='text/html, */*;q=0.8')
+        self.assertEqual(renderer_for_request(request).name, 'json')
+
+    def test_msgpack_response(self):
+        response = self.get(
+            CORSTest(),
+            '/cors_test',
+            headers={'HTTP_ACCEPT': 'application/x-msgpack'}
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertEqual(
+            response.content,
+            packb({'data': {'does it work?': 'yes'}})
+        )
+
+    @unittest.skipIf(msgpack is None, "msgpack isn't installed")
+    def test_msgpack_and_fallback_encode_alike(self):
+        payload = {
+            'data': [
+                'short', 'x' * 40, u'\xe9' * 200, 'y' * 70000,
+                0, 127, 200, -5, -200, 70000, 2 ** 40, -2 ** 40,
+                1.5, None, True, False, {'nested': (1, 2)}
+            ]
+        }
+        self.assertEqual(
+            encode_msgpack(payload),
+            packb(payload)
+        )
+
+
+class SerializedFieldsTest(HandlerTestCase):
+    def setUp(self):
+        super(SerializedFieldsTest, self).setUp()
+        author = Author.objects.create(name="adam")
+        tags = [Tag.objects.create(name=name) for name in ["a", "b"]]
+
+        for ii in range(10):
+            story = Story.objects.create(
+                title="story {0}".format(ii),
+                author=author if ii % 2 else None
+            )
+            story.tags.add(*tags[:ii % 3])
+
+    def test_values_path_matches_as_dict(self):
+        queryset = Story.objects.order_by('pk')
+
+        with self.assertNumQueries(2):
+            data = self.content(queryset_out(queryset))['data']
+
+        self.assertEqual(data, [story.as_dict for story in queryset])
+
+    def test_streaming_values_path(self):
+        response = self.get(StoryListHandler(), '/stories?format=ndjson')
+        self.assertEqual(
+            self.lines(response)[1:],
+            [story.as_dict for story in Story.objects.order_by('pk')]
+        )
+
+
+class ProfilingTest(HandlerTestCase):
+    def setUp(self):
+        super(ProfilingTest, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+        self.saved = (profiling.PROFILE_DIR, profiling.PROFILING_ENABLED)
+        profiling.PROFILE_DIR = self.profile_dir
+        profiling.PROFILING_ENABLED = True
+
+    def tearDown(self):
+        profiling.PROFILE_DIR, profiling.PROFILING_ENABLED = self.saved
+        shutil.rmtree(self.profile_dir)
+        super(ProfilingTest, self).tearDown()
+
+    def profiled(self, token_path):
+        return self.get(
+            CORSTest(),
+            '/cors_test',
+            headers={
+                'HTTP_X_SLEEPY_PROFILE': profiling.profile_token(token_path)}
+        )
+
+    def test_signed_token_triggers_profile(self):
+        response = self.profiled('/cors_test')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Sleepy-Profile'].startswith("CORSTest.GET."))
+        self.assertEqual(
+            os.listdir(self.profile_dir),
+            [response['X-Sleepy-Profile'] + ".pstats"]
+        )
+
+    def test_requests_without_a_valid_token_are_not_profiled(self):
+        self.get(CORSTest(), '/cors_test')
+        self.profiled('/elsewhere')
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_unwritable_profiles_keep_the_response(self):
+        # A file where the profile directory should be
+        profiling.PROFILE_DIR = os.path.join(self.profile_dir, "file", "dir")
+        open(os.path.join(self.profile_dir, "file"), "w").close()
+
+        response = self.profiled('/cors_test')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Sleepy-Profile'))
+
+    def test_profile_parameter_isnt_part_of_cache_keys(self):
+        self.assertEqual(
+            request_cache_key(self.factory.get('/cors_test?_profile=token')),
+            request_cache_key(self.factory.get('/cors_test'))
+        )
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+class WatchdogTest(HandlerTestCase):
+    def setUp(self):
+        super(WatchdogTest, self).setUp()
+        self.saved = (
+            watchdog.WATCHDOG_ENABLED,
+            watchdog.SLOW_REQUEST_THRESHOLD,
+            watchdog.SLOW_REQUEST_INTERVAL
+        )
+        watchdog.WATCHDOG_ENABLED = True
+        watchdog.SLOW_REQUEST_THRESHOLD = 0.1
+        watchdog.SLOW_REQUEST_INTERVAL = 0.02
+
+        self.handler = RecordingHandler()
+        watchdog.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        watchdog.logger.removeHandler(self.handler)
+        (watchdog.WATCHDOG_ENABLED,
+         watchdog.SLOW_REQUEST_THRESHOLD,
+         watchdog.SLOW_REQUEST_INTERVAL) = self.saved
+        super(WatchdogTest, self).tearDown()
+
+    def test_slow_request_is_recorded_with_stacks(self):
+        self.get(SlowHandler(), '/slow?password=hunter2&page=2')
+        watchdog.flush()
+
+        running, finished = self.handler.records
+        self.assertEqual(running['status'], 'running')
+        self.assertEqual(finished['status'], 'finished')
+        self.assertEqual(finished['handler'], 'test_project.testapp.views.SlowHandler')
+        self.assertEqual(
+            finished['params'],
+            {'password': '[redacted]', 'page': '2'}
+        )
+        self.assertEqual(
+            [phase['phase'] for phase in finished['phases']],
+            ['start', 'admission', 'handler', 'finalize']
+        )
+        self.assertTrue(finished['duration'] >= 0.3)
+        self.assertTrue(
+            any(":GET:" in stack for stack in finished['stacks'])
+        )
+
+    def test_fast_requests_are_not_recorded(self):
+        self.get(CORSTest(), '/cors_test')
+        watchdog.flush()
+        self.assertEqual(self.handler.records, [])
+
+
+class WarmUpTest(TestCase):
+    def test_warm_up_loads_handlers_and_replays(self):
+        summary = warm_up(['/cors_test', '/cached_complex_test_list'])
+
+        # The router's pattern warms each of its handlers
+        self.assertTrue(summary['handlers'] > summary['patterns'])
+        self.assertTrue(summary['patterns'] >= 4)
+        self.assertEqual(
+            summary['replayed'],
+            [('/cors_test', 200), ('/cached_complex_test_list', 200)]
+        )
+
+        # gitpython is loaded and the deployed commit read
+        self.assertTrue(hasattr(git_version, 'version'))
+
+    def test_replay_passes_the_host_check(self):
+        with self.settings(DEBUG=False, ALLOWED_HOSTS=['.example.com']):
+            self.assertEqual(warmup.warm_up_host(), 'example.com')
+            summary = warm_up(['/cors_test'])
+            self.assertEqual(summary['replayed'], [('/cors_test', 200)])
+
+
+class RouterTest(TestCase):
+    def setUp(self):
+        self.router = Router()
+        self.router.register('/stories/latest', 'latest')
+        self.router.register('/stories/{id:int}', 'story')
+        self.router.register('/stories/{slug:slug}', 'story_by_slug')
+        self.router.register('/files/{path:path}', 'file')
+
+    def test_typed_captures(self):
+        route, kwargs = self.router.resolve('stories/42/')
+        self.assertEqual(route.handler, 'story')
+        self.assertEqual(kwargs, {'id': 42})
+
+        route, kwargs = self.router.resolve('stories/a-title')
+        self.assertEqual(route.handler, 'story_by_slug')
+        self.assertEqual(kwargs, {'slug': 'a-title'})
+
+        route, kwargs = self.router.resolve('files/a/b.txt')
+        self.assertEqual(kwargs, {'path': 'a/b.txt'})
+
+    def test_literals_win_over_captures(self):
+        route, kwargs = self.router.resolve('stories/latest')
+        self.assertEqual(route.handler, 'latest')
+        self.assertEqual(kwargs, {})
+
+    def test_unknown_paths_fall_through(self):
+        self.assertEqual(self.router.resolve('stories/a title'), None)
+        self.assertEqual(self.router.resolve('authors/1'), None)
+
+        # Mounted routers hand unknown paths to the patterns after them
+        response = Client().get('/api/cors_test')
+        self.assertEqual(response.status_code, 200)
+
+    def test_mounted_router(self):
+        story = Story.objects.create(title="Routed")
+
+        response = Client().get('/api/stories/{0}'.format(story.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data']['title'], "Routed")
+
+        response = Client().get('/api/stories')
+        self.assertEqual(len(json.loads(response.content)['data']), 1)
+
+    def test_reverse(self):
+        story = Story.objects.create(title="Reversed")
+        path = reverse('story', kwargs={'id': story.pk})
+        self.assertEqual(path, '/api/stories/{0}'.format(story.pk))
+        self.assertEqual(Client().get(path).status_code, 200)
+
+        # Named routes are only reversed, never resolved, by their own
+        # patterns
+        self.assertEqual(Client().get('/api/stories/five').status_code, 404)
+        self.assertRaises(
+            NoReverseMatch,
+            reverse, 'story', kwargs={'id': 'five'}
+        )
+
+        # Names are unique within a router
+        self.router.register('/labels/{label}', 'label', 'label')
+        self.assertRaises(
+            ImproperlyConfigured,
+            self.router.register, '/tags/{tag}', 'tag', 'label'
+        )
+
+
+class BulkWriteTest(HandlerTestCase):
+    def bulk(self, method, items, handler=None):
+        return self.send(handler or StoryListHandler(), method, '/stories', items)
+
+    def test_valid_items_are_created_in_one_insert(self):
+        with self.assertNumQueries(1):
+            response = self.bulk('POST', [
+                {"title": "first"},
+                {"title": ""},
+                {"title": "second"},
+                "not an object",
+            ])
+
+        body = self.content(response)
+        self.assertEqual(
+            [result['status'] for result in body['data']],
+            [201, 400, 201, 400]
+        )
+        self.assertEqual(body['data'][0]['data'], {"title": "first"})
+        self.assertEqual(body['data'][1]['error']['type'], "Parameter Error")
+        self.assertEqual((body['succeeded'], body['failed']), (2, 2))
+        self.assertEqual(
+            sorted(Story.objects.values_list('title', flat=True)),
+            ["first", "second"]
+        )
+
+    def test_updates(self):
+        first = Story.objects.create(title="first")
+        second = Story.objects.create(title="second")
+
+        updated_at = first.updated_at
+
+        response = self.bulk('PUT', [
+            {"id": first.pk, "title": "renamed"},
+            {"id": second.pk, "title": "renamed"},
+            {"id": "x", "title": "renamed"},
+            {"id": 999, "title": "renamed"},
+        ])
+
+        body = self.content(response)
+        self.assertEqual(
+            [result['status'] for result in body['data']],
+            [200, 200, 400, 404]
+        )
+        self.assertEqual((body['succeeded'], body['failed']), (2, 2))
+        self.assertEqual(Story.objects.filter(title="renamed").count(), 2)
+
+        # auto_now fields move like they do on save()
+        self.assertTrue(Story.objects.get(pk=first.pk).updated_at > updated_at)
+
+    def test_batch_size_is_limited(self):
+        handler = StoryListHandler()
+        handler.bulk_max_items = 2
+
+        response = self.bulk('POST', [{"title": "a"}] * 3, handler)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Story.objects.count(), 0)
+
+    def test_single_items_still_work(self):
+        response = StoryListHandler()(
+            self.factory.post('/stories', {"title": "single"})
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Story.objects.get().title, "single")
+
+
+class SyncTest(HandlerTestCase):
+    def setUp(self):
+        super(SyncTest, self).setUp()
+        # Rows are polled right after they are written
+        sync.SYNC_SETTLE_TIME = 0
+        self.stories = [
+            Story.objects.create(title=title)
+            for title in ["first", "second", "third"]
+        ]
+
+    def tearDown(self):
+        sync.SYNC_SETTLE_TIME = 5
+        super(SyncTest, self).tearDown()
+
+    def poll(self, **params):
+        body = self.content(self.get(SyncStoryHandler(), '/stories/sync', params))
+        return [row['title'] for row in body['data']], body['sync']
+
+    def test_only_changes_are_sent(self):
+        titles, state = self.poll()
+        self.assertEqual(titles, ["first", "second", "third"])
+        self.assertTrue(state['full'])
+
+        self.stories[1].title = "renamed"
+        self.stories[1].save()
+        self.stories[2].deleted = True
+        self.stories[2].save()
+
+        titles, state = self.poll(since=state['token'])
+        self.assertEqual(titles, ["renamed"])
+        self.assertEqual(state['deleted'], [self.stories[2].pk])
+        self.assertFalse(state['full'])
+
+        titles, state = self.poll(since=state['token'])
+        self.assertEqual((titles, state['deleted']), ([], []))
+
+    def test_pages(self):
+        titles, state = self.poll(limit=2)
+        self.assertEqual((titles, state['more']), (["first", "second"], True))
+
+        titles, state = self.poll(limit=2, since=state['token'])
+        self.assertEqual((titles, state['more']), (["third"], False))
+
+    def test_streamed_changes(self):
+        lines = self.lines(
+            self.get(SyncStoryHandler(), '/stories/sync', {'format': 'ndjson'})
+        )
+        self.assertTrue(lines[0]['meta']['sync']['full'])
+        self.assertEqual(len(lines), 4)
+
+    def test_bad_token_asks_for_a_resync(self):
+        titles, state = self.poll(since="tampered")
+        self.assertEqual(len(titles), 3)
+        self.assertTrue(state['resync'])
+
+    def test_unchanged_polls_skip_the_database(self):
+        sync.SYNC_SETTLE_TIME = -1
+        _titles, state = self.poll()
+
+        with self.assertNumQueries(0):
+            titles, next_state = self.poll(since=state['token'])
+
+        self.assertEqual(titles, [])
+        self.assertEqual(next_state['token'], state['token'])
+
+    def test_rows_younger_than_the_settle_time_wait(self):
+        sync.SYNC_SETTLE_TIME = 60
+        titles, state = self.poll()
+        self.assertEqual(titles, [])
+
+        # Once settled the rows are sent, the token didn't pass them
+        Story.objects.update(
+            updated_at=timezone.now() - datetime.timedelta(minutes=5)
+        )
+        titles, state = self.poll(since=state['token'])
+        self.assertEqual(titles, ["first", "second", "third"])
+
+    def test_untracked_models_are_rejected(self):
+        self.assertRaises(
+            ImproperlyConfigured,
+            sync.sync_out, Author.objects.all(), 'id'
+        )
+
+
+class DeadlineTest(HandlerTestCase):
+    def remaining(self, response):
+        return self.content(response)['data']['remaining']
+
+    def test_requests_within_budget(self):
+        response = self.get(DeadlineHandler(), '/deadline')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(0 < self.remaining(response) <= 0.05)
+
+    def test_clients_can_shorten_the_budget(self):
+        response = self.get(
+            DeadlineHandler(),
+            '/deadline',
+            headers={'HTTP_X_REQUEST_TIMEOUT': '0.01'}
+        )
+        self.assertTrue(self.remaining(response) <= 0.01)
+
+    def test_late_requests_time_out(self):
+        response = self.get(DeadlineHandler(), '/deadline', {'sleep': 0.1})
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(
+            self.content(response)['error']['type'],
+            "Timeout Error"
+        )
+
+    def test_queries_are_bounded(self):
+        started = time.time()
+        response = self.get(DeadlineHandler(), '/deadline', {'query': 1})
+        self.assertEqual(response.status_code, 504)
+        self.assertTrue(time.time() - started < 1)
+
+
+class CoalesceTest(HandlerTestCase):
+    def setUp(self):
+        super(CoalesceTest, self).setUp()
+        CoalescedHandler.calls = 0
+
+    def get_concurrently(self, requests):
+        handler = CoalescedHandler()
+        responses = []
+
+        threads = [
+            threading.Thread(
+                target=lambda request: responses.append(handler(request)),
+                args=(request,)
+            )
+            for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return responses
+
+    def test_concurrent_identical_requests_run_once(self):
+        responses = self.get_concurrently(
+            [self.factory.get('/coalesced') for _ in range(8)]
+            + [self.factory.get('/other')]
+        )
+
+        self.assertEqual(CoalescedHandler.calls, 2)
+        self.assertEqual(len(responses), 9)
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+
+        # Every caller gets a response of its own to add headers to
+        self.assertEqual(len(set(id(r) for r in responses)), 9)
+
+    def test_users_dont_share_responses(self):
+        requests = []
+        for pk in [1, 2, 1, 2]:
+            request = self.factory.get('/coalesced')
+            request.user = User(pk=pk)
+            requests.append(request)
+
+        self.get_concurrently(requests)
+        self.assertEqual(CoalescedHandler.calls, 2)
+
+    def test_results_are_only_copied_for_waiters(self):
+        class Result(object):
+            copies = 0
+
+            def __getstate__(self):
+                Result.copies += 1
+                return {}
+
+        result = Result()
+        self.assertTrue(coalescing.run('/lone', lambda: result) is result)
+        self.assertEqual(Result.copies, 0)
+
+
+class StaleWhileRevalidateTest(HandlerTestCase):
+    def setUp(self):
+        super(StaleWhileRevalidateTest, self).setUp()
+        self.handler = StaleHandler()
+        StaleHandler.calls = 0
+
+    def calls(self):
+        return self.content(self.get(self.handler, '/stale'))['data']['calls']
+
+    def test_stale_entries_are_refreshed_once(self):
+        self.calls()
+        self.assertEqual(StaleHandler.calls, 1)
+
+        # Let the entry go stale, then miss it from many threads at once
+        time.sleep(0.25)
+        calls = []
+
+        threads = [
+            threading.Thread(target=lambda: calls.append(self.calls()))
+            for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(StaleHandler.calls, 2)
+        self.assertEqual(sorted(calls), [1] * 15 + [2])
+        self.assertEqual(self.calls(), 2)
+
+    def test_background_refreshes_get_a_deadline_of_their_own(self):
+        request = self.factory.get('/stale', HTTP_X_REQUEST_TIMEOUT='0.01')
+        request.deadline = time.time() - 1
+
+        fresh = refresh_request(request, 5)
+        self.assertTrue(4 < fresh.deadline - time.time() <= 5)
+        self.assertTrue(deadlines.expired(request))
+        self.assertFalse('HTTP_X_REQUEST_TIMEOUT' in fresh.META)
+
+
+class CircuitBreakerTest(HandlerTestCase):
+    def setUp(self):
+        super(CircuitBreakerTest, self).setUp()
+        self.handler = FlakyHandler()
+        FlakyHandler.calls = 0
+        FlakyHandler.failing = False
+
+    def flaky(self, path='/flaky'):
+        time.sleep(0.02)
+        return self.get(self.handler, path)
+
+    def test_open_breaker_serves_the_last_good_response(self):
+        self.flaky()
+        FlakyHandler.failing = True
+        self.assertEqual(self.flaky().status_code, 502)
+        self.assertEqual(self.flaky().status_code, 502)
+        self.assertEqual(FlakyHandler.calls, 3)
+
+        # The breaker is open, the cached response is served instead
+        response = self.flaky()
+        self.assertEqual(FlakyHandler.calls, 3)
+        self.assertEqual(self.content(response)['data']['calls'], 1)
+        self.assertTrue('Stale' in response['Warning'])
+
+        # Nothing is cached for other paths
+        response = self.flaky('/flaky/other')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_key_missing_an_argument_uses_the_handler_breaker(self):
+        class RegionHandler(Base):
+            @CircuitBreaker(key="geocoder:{region}", failure_threshold=1)
+            def GET(self, request, *args, **kwargs):
+                return api_error("the geocoder is down", "Geocoder Error", 502)
+
+        handler = RegionHandler()
+        self.assertEqual(self.get(handler, '/geo').status_code, 502)
+        self.assertEqual(self.get(handler, '/geo').status_code, 503)
+
+    def test_successful_probe_closes_the_breaker(self):
+        FlakyHandler.failing = True
+        self.flaky()
+        self.flaky()
+        self.assertEqual(self.flaky().status_code, 503)
+
+        # Once reset_timeout passes a single probe goes through
+        time.sleep(0.2)
+        FlakyHandler.failing = False
+        self.assertEqual(self.flaky().status_code, 200)
+        self.assertEqual(self.flaky().status_code, 200)
+        self.assertEqual(FlakyHandler.calls, 4)
+
+
+class PatchTest(HandlerTestCase):
+    def setUp(self):
+        super(PatchTest, self).setUp()
+        self.story = Story.objects.create(title="Old")
+
+    def patch(self, body, content_type, query=""):
+        return self.send(
+            StoryHandler(),
+            'PATCH',
+            '/stories/{0}{1}'.format(self.story.pk, query),
+            body,
+            content_type,
+            id=self.story.pk
+        )
+
+    def test_merge_patch(self):
+        response = self.patch(
+            {"title": "New", "author": {"name": "Ann"}},
+            'application/merge-patch+json'
+        )
+        self.assertEqual(
+            self.content(response)['data']['changed'],
+            ["author.name", "title"]
+        )
+        self.assertEqual(Story.objects.get().title, "New")
+
+    def test_patches_arent_parameters(self):
+        # The query string would override the body if patches were kwargs
+        response = self.patch(
+            {"title": "Body"},
+            'application/merge-patch+json',
+            "?title=Query"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Story.objects.get().title, "Body")
+
+    def test_json_patch(self):
+        response = self.patch(
+            [{"op": "replace", "path": "/title", "value": "Patched"}],
+            'application/json-patch+json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Story.objects.get().title, "Patched")
+
+    def test_unsupported_patches(self):
+        response = self.patch(
+            [{"op": "move", "from": "/a", "path": "/title"}],
+            'application/json-patch+json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.patch({"title": "New"}, 'text/plain')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(Story.objects.get().title, "Old")
+
+        # Paths into arrays are rejected rather than applied as replaces
+        for path in ["/tags/0", "/tags/-"]:
+            response = self.patch(
+                [{"op": "add", "path": path, "value": {"name": "a"}}],
+                'application/json-patch+json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_removals_and_nulls(self):
+        document = {"title": "Old", "author": {"name": "Ann"}, "draft": True}
+        changes = flatten_json_patch([
+            {"op": "remove", "path": "/draft"},
+            {"op": "replace", "path": "/author/name", "value": None},
+        ])
+        self.assertEqual(
+            apply_patch(document, changes),
+            {"title": "Old", "author": {"name": None}}
+        )
+
+        # Removed fields reach the handler as REMOVED, never the title
+        # ParameterAssert
+        response = self.patch({"title": None}, 'application/merge-patch+json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Story.objects.get().title, "Old")
+
+
+class MultiGetTest(HandlerTestCase):
+    def setUp(self):
+        super(MultiGetTest, self).setUp()
+        self.stories = [
+            Story.objects.create(title=title) for title in ["a", "b", "c"]]
+
+    def multiget(self, query):
+        response = self.get(StoryListHandler(), '/stories?' + query)
+        return response.status_code, self.content(response)
+
+    def test_rows_come_back_in_request_order(self):
+        first, _second, third = self.stories
+        status, body = self.multiget(
+            "ids={0},999&ids={1}".format(third.pk, first.pk))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [row and row['title'] for row in body['data']],
+            ["c", None, "a"]
+        )
+        self.assertEqual(body['not_found'], [999])
+
+    def test_rows_are_cached_per_id(self):
+        first, second, _third = self.stories
+        self.multiget("ids={0},{1}".format(first.pk, second.pk))
+
+        with self.assertNumQueries(0):
+            _status, body = self.multiget("ids={0}".format(second.pk))
+        self.assertEqual(body['data'][0]['title'], "b")
+
+        # Invalidating the story's tag expires its cached row
+        Story.objects.filter(pk=second.pk).update(title="renamed")
+        invalidate_tags("story:{0}".format(second.pk))
+        _status, body = self.multiget("ids={0}".format(second.pk))
+        self.assertEqual(body['data'][0]['title'], "renamed")
+
+    def test_cached_rows_dont_leak_into_narrower_querysets(self):
+        first, second, _third = self.stories
+        Story.objects.filter(pk=second.pk).update(deleted=True)
+        self.multiget("ids={0},{1}".format(first.pk, second.pk))
+
+        live = Story.objects.filter(deleted=False)
+        rows = rows_by_id(live, [first.pk, second.pk], 60)
+        self.assertEqual([row and row['title'] for row in rows], ["a", None])
+        self.assertEqual(rows_by_id(live.none(), [first.pk], 60), [None])
+
+    def test_id_count_is_limited(self):
+        status, body = self.multiget("ids=1,2,3,4")
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error']['type'], "Parameter Error")
+
+
+class TableOutTest(HandlerTestCase):
+    def table(self, params):
+        return self.get(TableListHandler(), '/table', params)
+
+    def test_objects_layout_matches_a_list_of_dictionaries(self):
+        body = self.content(self.table({}))
+        self.assertEqual(body['data'][3], {"id": 3, "update_time": "3"})
+        self.assertEqual(len(body['data']), 100)
+        self.assertEqual(body['actions'], {"do_something": "stuff"})
+
+    def test_columns_layout(self):
+        response = self.table({'layout': 'columns'})
+        body = self.content(response)
+        self.assertEqual(body['data']['columns'], ["id", "update_time"])
+        self.assertEqual(body['data']['rows'][3], [3, "3"])
+
+        expanded = self.table({})
+        self.assertTrue(len(response.content) < len(expanded.content))
+
+    def test_streamed_objects(self):
+        lines = self.lines(self.table({'format': 'ndjson'}))
+        self.assertEqual(lines[1], {"id": 0, "update_time": "0"})
+        self.assertEqual(len(lines), 101)
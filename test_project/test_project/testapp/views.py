@@ -1,8 +1,30 @@
 # Universe imports
+import time
 
 # Akimbo imports
+from django.db import connection
+
+from sleepy import bulk, deadlines
 from sleepy.base import Base
-from sleepy.responses import api_out
+from sleepy.helpers import apply_patch
+from sleepy.decorators import (
+    AcceptsIds,
+    CacheResponse,
+    CircuitBreaker,
+    Coalesce,
+    InvalidatesTags,
+    ParameterAssert,
+    ParameterType
+)
+from sleepy.responses import (
+    api_error,
+    api_out,
+    multiget_out,
+    queryset_out,
+    table_out
+)
+from sleepy.sync import sync_out
+from test_project.testapp.models import Story
 
 
 class ReturnComplexListHandler(Base):
@@ -33,3 +55,160 @@ class ReturnComplexListHandler(Base):
 class CORSTest(Base):
     def GET(self, request, *args, **kwargs):
         return api_out({ "does it work?": "yes" })
+
+
+class TaggedStoryHandler(Base):
+    renders = 0
+
+    @CacheResponse(
+        3600,
+        tags=["stories", "story:{id}"],
+        http_cache=True,
+        stale_while_revalidate=60
+    )
+    def GET(self, request, *args, **kwargs):
+        TaggedStoryHandler.renders += 1
+        return api_out({"id": kwargs["id"], "renders": self.renders})
+
+    @InvalidatesTags("story:{id}")
+    def POST(self, request, *args, **kwargs):
+        return api_out({"id": kwargs["id"]})
+
+
+class StoryListHandler(Base):
+    bulk_methods = ('POST', 'PUT')
+
+    @AcceptsIds(max_ids=3)
+    def GET(self, request, *args, **kwargs):
+        if 'ids' in kwargs:
+            return multiget_out(
+                Story.objects.all(),
+                kwargs['ids'],
+                duration=60,
+                tag="story:{id}"
+            )
+
+        return queryset_out(
+            Story.objects.order_by('pk'),
+            {"count": Story.objects.count()}
+        )
+
+    @ParameterAssert('title', lambda title: 0 < len(title) <= 200,
+                     "must be between 1 and 200 characters")
+    def POST(self, request, *args, **kwargs):
+        story = Story(title=kwargs['title'])
+        bulk.save(request, story)
+        return api_out({"title": story.title}, status_code=201)
+
+    @ParameterType(id=int)
+    def PUT(self, request, *args, **kwargs):
+        story = Story(pk=kwargs['id'], title=kwargs['title'])
+        bulk.save(request, story, update_fields=['title'])
+        return api_out({"id": story.pk})
+
+
+class LimitedHandler(StoryListHandler):
+    max_in_flight = 1
+
+
+class StoryHandler(Base):
+    def GET(self, request, *args, **kwargs):
+        story = Story.objects.get(pk=kwargs["id"])
+        return api_out(story.as_dict)
+
+    @ParameterAssert('title', lambda title: len(title) <= 200, "is too long")
+    def PATCH(self, request, *args, **kwargs):
+        story = Story.objects.get(pk=kwargs['id'])
+        document = apply_patch({"title": story.title}, request.PATCH)
+        if not document.get('title'):
+            return api_error("stories need a title", "Parameter Error", 400)
+
+        story.title = document['title']
+        story.save()
+        return api_out({"changed": sorted(request.PATCH)})
+
+
+class SlowHandler(Base):
+    def GET(self, request, *args, **kwargs):
+        time.sleep(0.3)
+        return api_out({"slow": True})
+
+
+class CachedComplexListHandler(ReturnComplexListHandler):
+    @CacheResponse(60)
+    def GET(self, request, *args, **kwargs):
+        return ReturnComplexListHandler.GET(self, request, *args, **kwargs)
+
+
+class SyncStoryHandler(Base):
+    def GET(self, request, *args, **kwargs):
+        return sync_out(
+            Story.objects.all(),
+            'updated_at',
+            'deleted',
+            limit=int(kwargs.get('limit', 100))
+        )
+
+
+class DeadlineHandler(Base):
+    timeout = 0.05
+
+    def GET(self, request, *args, **kwargs):
+        if "query" in kwargs:
+            with deadlines.bounded_queries():
+                # Counts far enough to take seconds unless it's aborted
+                connection.cursor().execute(
+                    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL "
+                    "SELECT x + 1 FROM c WHERE x < 100000000) "
+                    "SELECT count(*) FROM c"
+                )
+        else:
+            time.sleep(float(kwargs.get("sleep", 0)))
+            deadlines.check()
+
+        return api_out({"remaining": deadlines.remaining()})
+
+
+class CoalescedHandler(Base):
+    calls = 0
+
+    @Coalesce(timeout=5)
+    def GET(self, request, *args, **kwargs):
+        CoalescedHandler.calls += 1
+        time.sleep(0.2)
+        return api_out({"calls": CoalescedHandler.calls})
+
+
+class StaleHandler(Base):
+    calls = 0
+
+    @CacheResponse(0.2, stale_grace=60)
+    def GET(self, request, *args, **kwargs):
+        StaleHandler.calls += 1
+        time.sleep(0.2)
+        return api_out({"calls": StaleHandler.calls})
+
+
+class FlakyHandler(Base):
+    failing = False
+    calls = 0
+
+    @CircuitBreaker(failure_threshold=2, reset_timeout=0.2, probe_interval=60)
+    @CacheResponse(0.01, stale_while_revalidate=60)
+    def GET(self, request, *args, **kwargs):
+        FlakyHandler.calls += 1
+        if FlakyHandler.failing:
+            return api_error("the dependency is down", "Dependency Error", 502)
+        return api_out({"calls": FlakyHandler.calls})
+
+
+class TableListHandler(Base):
+    def GET(self, request, *args, **kwargs):
+        """
+        The rows of ReturnComplexListHandler's stories as a table
+        """
+        return table_out(
+            ("id", "update_time"),
+            ((id_, str(id_)) for id_ in range(100)),
+            {"actions": {"do_something": "stuff"}}
+        )
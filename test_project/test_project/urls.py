@@ -1,15 +1,28 @@
-from django.conf.urls import patterns, url
+from django.conf.urls import include, patterns, url
 
 # Uncomment the next two lines to enable the admin:
 # from django.contrib import admin
 # admin.autodiscover()
 
-from testapp.views import ReturnComplexListHandler, CORSTest
+from testapp.views import (
+    CachedComplexListHandler,
+    ReturnComplexListHandler,
+    CORSTest,
+    StoryHandler,
+    StoryListHandler
+)
+from sleepy.router import Router
+
+router = Router()
+router.register('/stories', StoryListHandler())
+router.register('/stories/{id:int}', StoryHandler(), name='story')
 
 urlpatterns = patterns(
     '',
+    url(r'^cached_complex_test_list', CachedComplexListHandler()),
     url(r'complex_test_list', ReturnComplexListHandler()),
     url(r'cors_test', CORSTest()),
+    url(r'^api/', include(router.urls)),
     # Examples:
     # url(r'^$', 'test_project.views.home', name='home'),
     # url(r'^test_project/', include('test_project.foo.urls')),
@@ -14,6 +14,7 @@ framework.
 
 """
 import os
+import logging
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_project.settings")
 
@@ -23,6 +24,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_project.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Import every handler, compile the routes and prime the caches before
+# the server forks its workers (e.g. gunicorn --preload) so the workers
+# share the warmed state
+from sleepy.warmup import warm_up
+try:
+    warm_up()
+except Exception:
+    logging.getLogger('sleepy.warmup').exception("warm up failed")
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)